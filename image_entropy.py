@@ -0,0 +1,647 @@
+"""Python (v2.7) code to accompany book:  Information Theory by JV Stone, 2015.
+File: image_entropy.py.
+Copyright: 2015, JV Stone, Psychology Department, Sheffield University,
+                    Sheffield, England.
+This code can be downloaded from
+    http://jim-stone.staff.shef.ac.uk/BookInfoTheory/InfoTheoryPython.html
+Creative Commons License (http://creativecommons.org/licenses/by-nc/4.0/).
+You are free to share and adapt for non-commercial purposes only.
+
+Summary: Library module with functions for calculating the grey-level
+histogram and entropy of an image, as in Figure 1.6, without looping over
+the pixels in Python."""
+
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+import numpy as np
+from PIL import Image
+import information_theory as it
+
+# PIL image modes with 8 bits per band, whose histogram PIL can count itself
+EIGHT_BIT_MODES = ("1", "L", "P", "LA", "RGB", "RGBA", "RGBX", "CMYK",
+                   "YCbCr", "LAB", "HSV")
+
+
+def histogram(image):
+    """Arguments:
+            image:  a PIL image, or a numpy array of non-negative integer
+                pixel values with any channels along the last axis
+       returns:
+            frequencies:  int array, the number of pixels at each level.
+                Its shape is (levels, ) for a single channel image, or
+                (channels, levels).  There are 256 levels for 8-bit images
+                and 65536 for 16-bit images."""
+
+    if isinstance(image, Image.Image):
+        if image.mode in EIGHT_BIT_MODES:
+            # PIL counts 8-bit images in C, straight from its own pixel
+            # buffer, returning 256 counts per band.
+            bands = len(image.getbands())
+            frequencies = np.array(image.histogram(), dtype=np.int64)
+            frequencies = frequencies.reshape(bands, 256)
+            if bands == 1:
+                frequencies = frequencies[0]
+            return frequencies
+
+        # Other modes (e.g. 16-bit "I;16") are binned by PIL into 256
+        # ranges, so count their pixel values with numpy instead.
+        image = np.asarray(image)
+
+    pixels = np.asarray(image)
+
+    if pixels.dtype == np.bool_:
+        pixels = pixels.view(np.uint8)
+        levels = 2
+    else:
+        levels = pixel_levels(pixels)
+
+    if pixels.ndim <= 2:
+        # ravel does not copy a contiguous image
+        return np.bincount(pixels.ravel(), minlength=levels)
+
+    channels = pixels.reshape(-1, pixels.shape[-1])
+    return np.array([np.bincount(channels[:, band], minlength=levels)
+                     for band in range(channels.shape[1])])
+
+
+def pixel_levels(pixels):
+    """Arguments:
+            pixels:  numpy array of non-negative integer pixel values
+       returns:
+            levels:  integer, the number of possible pixel values: 256 for
+                8-bit and 65536 for 16-bit images, otherwise the largest
+                value plus one"""
+
+    # Test the kind and size rather than comparing with np.uint16, so that
+    # big-endian 16-bit files (mode I;16B) are recognised too
+    if pixels.dtype.kind == 'u' and pixels.dtype.itemsize == 1:
+        return 256
+
+    if pixels.dtype.kind == 'u' and pixels.dtype.itemsize == 2:
+        return 65536
+
+    if pixels.min() < 0:
+        raise ValueError('Negative pixel value')
+
+    return int(pixels.max()) + 1
+
+
+def image_entropy(image):
+    """Arguments:
+            image:  a PIL image or numpy array, as for histogram
+       returns:
+            HX:  the entropy of the pixel values in bits.  A float for a
+                single channel image, or an array with one entropy per
+                channel."""
+
+    frequencies = histogram(image)
+
+    if frequencies.ndim == 1:
+        return it.entropy_from_frequencies(frequencies)
+
+    # One entropy per channel, all calculated in a single batch
+    channels, levels = frequencies.shape
+    HX, _ = it.entropies_from_frequencies(
+        frequencies.ravel(), np.arange(channels + 1) * levels)
+
+    return HX
+
+
+# The predictors accepted by difference_image
+PREDICTORS = ("horizontal", "vertical", "med")
+
+
+def difference_image(image, predictor="horizontal"):
+    """Arguments:
+            image:  a single channel PIL image or 2D numpy array of
+                non-negative integer pixel values.  It is not changed.
+            predictor:  string, how each pixel is predicted from the pixels
+                before it:
+                "horizontal":  the pixel to its left, as in Figure 1.8
+                "vertical":  the pixel above it
+                "med":  the median edge detector of LOCO-I (JPEG-LS), which
+                    uses the pixels to the left, above and above-left
+       returns:
+            differences:  int array, each pixel minus its prediction, for
+                every pixel that has the neighbours the predictor needs"""
+
+    pixels = np.asarray(image)
+    if pixels.ndim != 2:
+        raise ValueError('Difference images need a single channel image')
+
+    # Signed, so the differences can be negative
+    pixels = pixels.astype(np.int32)
+
+    if predictor == "horizontal":
+        return pixels[:, 1:] - pixels[:, :-1]
+
+    if predictor == "vertical":
+        return pixels[1:, :] - pixels[:-1, :]
+
+    if predictor == "med":
+        current = pixels[1:, 1:]
+        left = pixels[1:, :-1]
+        above = pixels[:-1, 1:]
+        above_left = pixels[:-1, :-1]
+
+        low = np.minimum(left, above)
+        high = np.maximum(left, above)
+
+        # Predict the lower neighbour at an edge above/left, the higher at
+        # an edge below/right, and a plane through the three neighbours
+        # otherwise.
+        prediction = np.where(above_left >= high, low,
+                              np.where(above_left <= low, high,
+                                       left + above - above_left))
+
+        return current - prediction
+
+    raise ValueError('Unknown predictor %r' % (predictor, ))
+
+
+def difference_histogram(image, predictor="horizontal"):
+    """Arguments:
+            image:  as for difference_image
+            predictor:  string, one of PREDICTORS
+       returns:
+            frequencies:  int array, the number of pixels with each
+                difference.  For 8-bit images there are 511 counts, for
+                the differences -255 to 255, as in Figure 1.8b."""
+
+    pixels = np.asarray(image)
+    levels = pixel_levels(pixels)
+
+    differences = difference_image(pixels, predictor)
+
+    # Shift the differences so that -(levels - 1) is counted in bin 0
+    return np.bincount((differences + (levels - 1)).ravel(),
+                       minlength=2 * levels - 1)
+
+
+def difference_entropy(image, predictor="horizontal"):
+    """Arguments:
+            image:  as for difference_image
+            predictor:  string, one of PREDICTORS
+       returns:
+            HX:  float, the entropy of the differences in bits"""
+
+    return it.entropy_from_frequencies(difference_histogram(image, predictor))
+
+
+# numpy dtypes for the PIL raw modes that memory_mapped_image can map
+RAW_MODE_DTYPES = {"L": "u1", "I;16": "<u2", "I;16L": "<u2", "I;16B": ">u2"}
+
+
+def memory_mapped_image(path):
+    """Arguments:
+            path:  string, an uncompressed single channel image file, e.g.
+                an uncompressed 8 or 16-bit TIFF
+       returns:
+            pixels:  read only 2D numpy memmap of the pixels.  Only the
+                parts of the file that are used are read into memory.
+
+    Compressed images (e.g. JPEG, or LZW TIFF) cannot be read a part at a
+    time, and raise ValueError.  Convert them to uncompressed TIFF first."""
+
+    # Pillow refuses to open images of more than Image.MAX_IMAGE_PIXELS,
+    # as a guard against decompression bombs.  Only the header is read
+    # here and nothing is decompressed, so the limit is lifted while the
+    # file is opened.
+    max_pixels = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        image = Image.open(path)
+    finally:
+        Image.MAX_IMAGE_PIXELS = max_pixels
+    try:
+        width, height = image.size
+        tiles = image.tile
+    finally:
+        image.close()
+
+    # An uncompressed image is stored as "raw" tiles, e.g. one for each
+    # strip of rows of a TIFF
+    if not tiles or any(tile[0] != "raw" for tile in tiles):
+        raise ValueError('%s is not an uncompressed image' % (path, ))
+
+    _, _, offset, args = tiles[0]
+    rawmode, stride, orientation = (tuple(args) + (0, 1))[:3]
+    if rawmode not in RAW_MODE_DTYPES:
+        raise ValueError('Unsupported raw mode %r' % (rawmode, ))
+
+    dtype = np.dtype(RAW_MODE_DTYPES[rawmode])
+    stride = stride or width * dtype.itemsize
+
+    # The tiles can be mapped as one array if they are full width bands of
+    # rows, in order, and each follows on from the last in the file
+    top = 0
+    for _, extents, tile_offset, tile_args in tiles:
+        if tuple(tile_args) != tuple(args) or \
+                tuple(extents) != (0, top, width, extents[3]) or \
+                tile_offset != offset + top * stride:
+            raise ValueError('The rows of %s are not stored in order' %
+                             (path, ))
+        top = extents[3]
+    if top != height:
+        raise ValueError('The rows of %s are not stored in order' % (path, ))
+
+    rows = np.memmap(path, dtype=np.uint8, mode="r", offset=offset,
+                     shape=(height, stride))
+    pixels = rows[:, :width * dtype.itemsize].view(dtype)
+
+    # Negative orientation means the rows are stored bottom up (e.g. BMP)
+    if orientation < 0:
+        pixels = pixels[::-1]
+
+    return pixels
+
+
+def array_tiles(pixels, tile_height=1024, tile_width=1024):
+    """A generator function that yields the tiles of a 2D array (e.g. a
+    memmap from memory_mapped_image) in raster order: left to right along
+    each band of rows, top to bottom.
+
+       Arguments:
+            pixels:  2D array
+            tile_height, tile_width:  integers, the size of each tile.  Set
+                tile_width to the image width to read whole strips.
+       returns:
+            (row, col, tile):  the position of the tile's top left pixel,
+                and the tile"""
+
+    height, width = pixels.shape
+    for row in range(0, height, tile_height):
+        for col in range(0, width, tile_width):
+            yield row, col, pixels[row:row + tile_height,
+                                   col:col + tile_width]
+
+
+def tiled_histograms(tiles, levels=256):
+    """Accumulates the grey-level histogram (as histogram) and horizontal
+    difference histogram (as difference_histogram) of an image one tile at
+    a time.  Only one tile and one column of pixels are held at once.
+
+    Differences between the last column of a tile and the first column of
+    the tile to its right are counted when the right tile arrives, so the
+    results are identical to the whole-image calculation.
+
+       Arguments:
+            tiles:  iterable of (row, col, tile) in raster order, as from
+                array_tiles.  Tiles in the same band share their row and
+                height.
+            levels:  integer, the number of grey levels, e.g. 256 for
+                8-bit and 65536 for 16-bit images
+       returns:
+            frequencies:  int array, the count of each grey level
+            differences:  int array, the count of each horizontal
+                difference, -(levels - 1) to levels - 1"""
+
+    frequencies = np.zeros(levels, dtype=np.int64)
+    differences = np.zeros(2 * levels - 1, dtype=np.int64)
+
+    # The position just right of the last tile, and its last column
+    edge_position, edge = None, None
+
+    for row, col, tile in tiles:
+        tile = np.asarray(tile)
+
+        frequencies += np.bincount(tile.ravel(), minlength=levels)
+        differences += np.bincount(
+            (difference_image(tile) + (levels - 1)).ravel(),
+            minlength=2 * levels - 1)
+
+        # Pair this tile's first column with the last column of the tile
+        # to its left
+        if edge_position == (row, col):
+            boundary = tile[:, 0].astype(np.int32) - edge
+            differences += np.bincount(boundary + (levels - 1),
+                                       minlength=2 * levels - 1)
+
+        edge_position = (row, col + tile.shape[1])
+        edge = tile[:, -1].astype(np.int32)
+
+    return frequencies, differences
+
+
+def tiled_entropy(image, tile_height=1024, tile_width=1024):
+    """Arguments:
+            image:  string, the path of an uncompressed image (see
+                memory_mapped_image), or a 2D array, e.g. a memmap
+            tile_height, tile_width:  integers, the size of each tile
+       returns:
+            HX:  float, the grey-level entropy, as image_entropy
+            Hdiff:  float, the horizontal difference entropy, as
+                difference_entropy
+
+    Peak memory is proportional to the tile size, not the image size."""
+
+    # Anything that is not an array is taken to be a path
+    if not hasattr(image, "shape"):
+        image = memory_mapped_image(image)
+
+    frequencies, differences = tiled_histograms(
+        array_tiles(image, tile_height, tile_width), pixel_levels(image))
+
+    return (it.entropy_from_frequencies(frequencies),
+            it.entropy_from_frequencies(differences))
+
+
+def local_entropy(image, window=(9, 9), processes=1, band_rows=256):
+    """Calculates the entropy of the grey levels in a window around every
+    pixel, e.g. for texture or saliency maps.
+
+    The window histograms are not rebuilt for each pixel.  Every row of the
+    map keeps its own histogram, and the running sum S of n * log2(n) over
+    its counts, as StreamingEntropy does.  As the windows slide one column
+    to the right, only the column of pixels leaving each window and the
+    column entering it change the histograms, and each window's entropy is
+    log2(N) - S / N for the N pixels in the window.  All the rows slide
+    together in array operations.
+
+       Arguments:
+            image:  a single channel PIL image or 2D numpy array of
+                non-negative integer pixel values
+            window:  (height, width) of the window, both odd so that the
+                window is centred on its pixel
+            processes:  integer, the number of worker processes.  The rows
+                are split into bands of band_rows rows, which are
+                calculated in parallel.
+            band_rows:  integer, the rows in each band
+       returns:
+            entropies:  float array, the same shape as the image.  Windows
+                running off the edge of the image are filled in by
+                reflecting the image at its edges."""
+
+    pixels = np.asarray(image)
+    if pixels.ndim != 2:
+        raise ValueError('Local entropy needs a single channel image')
+
+    window_height, window_width = window
+    if window_height % 2 == 0 or window_width % 2 == 0:
+        raise ValueError('Window height and width must be odd')
+
+    levels = pixel_levels(pixels)
+    height, _ = pixels.shape
+
+    padded = np.pad(pixels, ((window_height // 2, window_height // 2),
+                             (window_width // 2, window_width // 2)),
+                    mode="reflect")
+
+    # Each band needs window_height - 1 extra padded rows below it
+    tasks = [(padded[row:row + band_rows + window_height - 1],
+              window_height, window_width, levels)
+             for row in range(0, height, band_rows)]
+
+    if processes == 1:
+        bands = [local_entropy_band(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            bands = pool.map(local_entropy_band, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    return np.vstack(bands)
+
+
+def local_entropy_band(task):
+    """Worker for local_entropy.  Calculates the local entropy of every
+    pixel in one band of rows.
+
+       Arguments:
+            task:  tuple of (padded, window_height, window_width, levels),
+                where padded holds the band's rows plus window_height - 1
+                rows of padding, and window_width - 1 columns of padding
+       returns:
+            entropies:  float array, one row per row of the band"""
+
+    padded, window_height, window_width, levels = task
+    rows = padded.shape[0] - window_height + 1
+    columns = padded.shape[1] - window_width + 1
+    size = window_height * window_width
+
+    # n * log2(n) for every count a window can hold
+    counts = np.arange(size + 1)
+    nlogn = np.zeros(size + 1)
+    nlogn[1:] = counts[1:] * np.log2(counts[1:])
+
+    histograms = np.zeros((rows, levels), dtype=np.int32)
+    sum_nlogn = np.zeros(rows)
+    row_index = np.arange(rows)
+
+    entropies = np.zeros((rows, columns))
+
+    for column in range(padded.shape[1]):
+        # The column leaving every window, and the one entering it
+        changes = [(column, 1)]
+        if column >= window_width:
+            changes.insert(0, (column - window_width, -1))
+
+        for changed, change in changes:
+            for offset in range(window_height):
+                # One pixel per window, so no window sees a bin twice
+                values = padded[offset:offset + rows, changed]
+                old = histograms[row_index, values]
+                histograms[row_index, values] = old + change
+                sum_nlogn += nlogn[old + change] - nlogn[old]
+
+        if column >= window_width - 1:
+            entropies[:, column - window_width + 1] = \
+                np.log2(size) - sum_nlogn / size
+
+    # Rounding can leave tiny negative values for flat windows
+    return np.maximum(entropies, 0.0)
+
+
+# The columns written by scan_images, one row per image
+SCAN_COLUMNS = ("path", "width", "height", "grey_entropy",
+                "difference_entropy", "error")
+
+# The file extensions find_images treats as images
+IMAGE_EXTENSIONS = (".bmp", ".gif", ".jpeg", ".jpg", ".png", ".tif", ".tiff")
+
+
+def find_images(source):
+    """A generator function that yields the image paths to scan.
+
+       Arguments:
+            source:  string, either a directory, which is searched
+                recursively for files with IMAGE_EXTENSIONS, or a manifest
+                file listing one image path per line
+       returns:
+            path:  the next image path"""
+
+    if os.path.isdir(source):
+        for directory, subdirectories, filenames in os.walk(source):
+            # Walk in a fixed order, so runs are repeatable
+            subdirectories.sort()
+            for filename in sorted(filenames):
+                if filename.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(directory, filename)
+    else:
+        with open(source) as manifest:
+            for line in manifest:
+                path = line.strip()
+                if path:
+                    yield path
+
+
+def scan_image(path):
+    """Worker for scan_images.  Calculates the grey-level entropy (as in
+    infotheory1_6) and the horizontal difference entropy (as in
+    infotheory1_8) of one image.
+
+       Arguments:
+            path:  string, the image file
+       returns:
+            row:  tuple of values for SCAN_COLUMNS.  If the image cannot be
+                read, the entropies are blank and error says why."""
+
+    try:
+        image = Image.open(path)
+        try:
+            width, height = image.size
+
+            # Colour images are scored on their grey levels
+            if image.mode not in ("L", "I", "I;16"):
+                image = image.convert("L")
+
+            pixels = np.asarray(image)
+        finally:
+            image.close()
+
+        return (path, width, height,
+                "%.6f" % image_entropy(pixels),
+                "%.6f" % difference_entropy(pixels), "")
+
+    except Exception as error:
+        return (path, "", "", "", "", "%s: %s" % (type(error).__name__, error))
+
+
+def open_csv(path, mode):
+    """Opens path for the csv module, in the way it needs for this
+    version of Python."""
+
+    if sys.version_info[0] < 3:
+        return open(path, mode + "b")
+
+    return open(path, mode, newline="")
+
+
+def truncate_partial_row(path, block_size=64 * 1024):
+    """Cuts the file at path back to the end of its last complete line.  A
+    run that is killed part way through writing a row leaves the start of
+    that row at the end of the output, and appending to it would run the
+    next row into it.
+
+       Arguments:
+            path:  string, the file to truncate
+            block_size:  integer, the bytes read at a time, working back
+                from the end of the file
+       returns:
+            size:  integer, the size of the file afterwards"""
+
+    with open(path, "r+b") as outfile:
+        outfile.seek(0, os.SEEK_END)
+        size = outfile.tell()
+
+        # Search back from the end, a block at a time, for the last newline
+        end = size
+        keep = 0
+        while end > 0:
+            start = max(end - block_size, 0)
+            outfile.seek(start)
+            newline = outfile.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                keep = start + newline + 1
+                break
+            end = start
+
+        if keep < size:
+            outfile.truncate(keep)
+
+    return keep
+
+
+def scan_images(source, output_path, processes=None, checkpoint_every=100,
+                tasks_per_worker=1000):
+    """Scores every image from find_images(source) in a pool of worker
+    processes, and writes one CSV row per image to output_path.
+
+    The output file is also the checkpoint.  Rows are flushed to disk every
+    checkpoint_every images, and images already listed in output_path are
+    skipped, so a run that is stopped can be started again where it left
+    off.  A row left half written by the stopped run is cut off, and its
+    image is scored again.  Each worker is replaced after tasks_per_worker images, which
+    bounds the memory a worker can build up.
+
+       Arguments:
+            source:  string, a directory or manifest, as for find_images
+            output_path:  string, the CSV file to write or extend
+            processes:  integer, the number of worker processes.  Defaults
+                to the number of cores.
+            checkpoint_every:  integer, the images between flushes
+            tasks_per_worker:  integer, the images each worker scores
+                before it is replaced
+       returns:
+            count:  integer, the number of images scored by this run"""
+
+    done = set()
+    resuming = (os.path.exists(output_path) and
+                truncate_partial_row(output_path) > 0)
+    if resuming:
+        with open_csv(output_path, "r") as infile:
+            done = set(row["path"] for row in csv.DictReader(infile))
+
+    paths = (path for path in find_images(source) if path not in done)
+
+    count = 0
+    pool = multiprocessing.Pool(processes, maxtasksperchild=tasks_per_worker)
+    try:
+        with open_csv(output_path, "a") as outfile:
+            writer = csv.writer(outfile)
+            if not resuming:
+                writer.writerow(SCAN_COLUMNS)
+
+            # imap_unordered reads paths lazily and returns rows as soon
+            # as they are ready, so neither list is held in memory.
+            for row in pool.imap_unordered(scan_image, paths, chunksize=16):
+                writer.writerow(row)
+                count += 1
+                if count % checkpoint_every == 0:
+                    outfile.flush()
+                    os.fsync(outfile.fileno())
+    finally:
+        pool.close()
+        pool.join()
+
+    return count
+
+
+def main():
+    """Headless batch entry point, e.g.
+        python image_entropy.py photos/ entropies.csv --processes 8"""
+
+    parser = argparse.ArgumentParser(
+        description="Calculate the grey-level and difference entropy of "
+                    "every image in a directory or manifest.")
+    parser.add_argument("source", help="image directory or manifest file")
+    parser.add_argument("output", help="CSV file to write or resume")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--checkpoint-every", type=int, default=100,
+                        help="images between flushes of the output")
+    args = parser.parse_args()
+
+    count = scan_images(args.source, args.output, args.processes,
+                        args.checkpoint_every)
+
+    sys.stderr.write("Scored %d images\n" % count)
+
+
+if __name__ == "__main__":
+    main()
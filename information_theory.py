@@ -22,7 +22,15 @@ distributions."""
 
 
 from collections import Counter
+import copy
+import heapq
+import itertools
 import math
+import multiprocessing
+import os
+import tempfile
+import zlib
+import numpy as np
 
 
 def entropy_from_probabilities(probabilities):
@@ -31,34 +39,38 @@ def entropy_from_probabilities(probabilities):
        returns:
             HX:  float, the entropy of the passed distribution"""
 
-    # Check we have a valid list of probabilities
+    # Check we have a valid array of probabilities
     probabilities = valid_probabilities(probabilities)
 
-    # Set entropy count to zero
-    HX = 0
+    # Sum the entropy from all probabilities in one array operation
+    # (Eq 2.52 P37), rather than looping over them one at a time.
+    HX = np.sum(probabilities * np.log2(1.0 / probabilities))
 
-    # Loop over all probabilities and sum the entropy from each (Eq 2.52 P37)
-    for px in probabilities:
-        HX = HX + px * log2(1.0/px)
-
-    return HX
+    return float(HX)
 
 
 def entropy_from_frequencies(frequencies):
     """Arguments:
             frequencies:  iterable, a frequency distribution
        returns:
-            HX:  float, the entropy of the passed distribution"""
+            HX:  float, the entropy of the passed distribution
+
+    frequencies can also be a StreamingEntropy, CountMinSketch or
+    StreamingHistogram, whose frequencies() are then used."""
+
+    if hasattr(frequencies, 'frequencies'):
+        frequencies = frequencies.frequencies()
 
     # Transform the frequencies to probabilities. The probability of
     # an event is its frequency divided by the sum of all frequencies.
 
-    sum_of_frequencies = sum(frequencies)
+    frequencies = to_array(frequencies)
+
+    sum_of_frequencies = frequencies.sum()
 
-    # Make a list of : the probabilty for each frequency in the
-    # list of frequencies.
+    # Divide the whole array of frequencies by their sum at once.
 
-    probabilities = [freq / float(sum_of_frequencies) for freq in frequencies]
+    probabilities = frequencies / sum_of_frequencies
 
     #
     # Now we have a probability distribution, we can find the entropy
@@ -77,14 +89,18 @@ def entropy_from_sample(distribution):
        returns:
             HX:  float, the entropy of the passed distribution"""
 
-    # Use Counter to count the occurrence of each different value in the
-    # distribution.  This returns a dict.  The values() method returns
-    # all the values of the dict, which for the Counter object is a list
-    # of frequencies.
-
-    counterdict = Counter(distribution)
+    if isinstance(distribution, np.ndarray):
+        # An array of values can be counted without a Python loop.
+        # np.unique returns the count of each different value.
+        _, frequencies = np.unique(distribution, return_counts=True)
+    else:
+        # Use Counter to count the occurrence of each different value in
+        # the distribution.  This returns a dict.  The values() method
+        # returns all the values of the dict, which for the Counter object
+        # is a list of frequencies.
+        counterdict = Counter(distribution)
 
-    frequencies = counterdict.values()
+        frequencies = counterdict.values()
 
     #
     # Now we have a frequency distribution, we can find the entropy
@@ -94,6 +110,371 @@ def entropy_from_sample(distribution):
     return HX
 
 
+def entropies_from_frequencies(frequencies, offsets=None):
+    """Arguments:
+            frequencies:  either a ragged collection of frequency
+                distributions, e.g. [[3, 1], [5, 2, 2], [7]] or the
+                values() of a dict of Counters, or (with offsets) one
+                flat array holding all the distributions end to end
+            offsets:  optional array of len(distributions) + 1 positions.
+                Distribution i is frequencies[offsets[i]:offsets[i + 1]]
+       returns:
+            HX:  array, the entropy of each distribution
+            totals:  array, the sum of the frequencies of each
+                distribution, i.e. its weight
+
+    All the entropies are calculated together in a single pass over the
+    flat array, rather than by one call to entropy_from_frequencies per
+    distribution."""
+
+    if offsets is None:
+        # Lay the distributions end to end in one flat list, recording
+        # where each one starts and stops.
+        flat = []
+        offsets = [0]
+        for distribution in frequencies:
+            flat.extend(distribution)
+            offsets.append(len(flat))
+        frequencies = flat
+
+    frequencies = to_array(frequencies)
+    offsets = np.asarray(offsets, dtype=np.intp)
+
+    if offsets[-1] != len(frequencies):
+        raise ValueError('Offsets do not cover the frequencies')
+
+    if len(frequencies) and frequencies.min() < 0:
+        raise ValueError('Negative frequency')
+
+    # For a distribution with frequencies n_i summing to N, Eq 2.52 P37
+    # can be rewritten as H = log2(N) - sum(n_i * log2(n_i)) / N, so all we
+    # need for each distribution is the sum of n and of n * log2(n).
+    nlogn = np.zeros(len(frequencies))
+    positive = frequencies > 0
+    nlogn[positive] = frequencies[positive] * np.log2(frequencies[positive])
+
+    starts = offsets[:-1]
+    nonempty = offsets[1:] > starts
+
+    totals = np.zeros(len(starts))
+    sum_nlogn = np.zeros(len(starts))
+    if nonempty.any():
+        totals[nonempty] = np.add.reduceat(frequencies, starts[nonempty])
+        sum_nlogn[nonempty] = np.add.reduceat(nlogn, starts[nonempty])
+
+    # Distributions with no counts have zero weight and zero entropy
+    HX = np.zeros(len(starts))
+    counted = totals > 0
+    HX[counted] = (np.log2(totals[counted]) -
+                   sum_nlogn[counted] / totals[counted])
+
+    # Rounding can leave tiny negative values for single-outcome
+    # distributions
+    HX = np.maximum(HX, 0.0)
+
+    return HX, totals
+
+
+def nlog2n(count):
+    """Arguments:
+            count:  a non-negative number
+       returns:
+            result:  float, count * log2(count), taken as 0 for a count
+                of 0"""
+
+    if count > 0:
+        result = count * log2(count)
+    else:
+        result = 0.0
+
+    return result
+
+
+class StreamingEntropy(object):
+    """Running entropy estimate for a stream of tokens that may never end.
+
+    Feed the stream in batches with update(); entropy() can be read at any
+    time.  Besides the count of each distinct token, the estimator keeps
+    the total count N and the running sum S of n * log2(n) over all the
+    counts, so that (Eq 2.52 P37)
+
+        H = log2(N) - S / N
+
+    costs O(1) to read and nothing is rescanned.  Memory grows with the
+    number of distinct tokens, not with the length of the stream.
+
+    The counts are exact.  Estimators pickle and can be merged, so shards
+    of a corpus can be counted in separate processes and then reduced
+    (see CountMinSketch for a fixed-memory, approximate alternative).
+
+    e.g.  estimator = StreamingEntropy()
+          for line in log_file:
+              estimator.update(line.split())
+          print estimator.entropy()"""
+
+    def __init__(self, tokens=()):
+        """Arguments:
+                tokens:  iterable, an optional first batch of tokens"""
+
+        self.counts = Counter()
+        self.total = 0
+        self.sum_nlogn = 0.0
+
+        self.update(tokens)
+
+    def update(self, tokens):
+        """Arguments:
+                tokens:  iterable, the next batch of tokens from the stream
+           returns:
+                self, so calls can be chained"""
+
+        # Count the batch first, so each distinct token in the batch only
+        # changes the running sums once.
+        for token, count in Counter(tokens).items():
+            self.add(token, count)
+
+        return self
+
+    def add(self, token, count=1):
+        """Arguments:
+                token:  the token seen
+                count:  integer, the number of times it was seen
+           returns:
+                self, so calls can be chained"""
+
+        old = self.counts[token]
+        new = old + count
+
+        # Swap the old n * log2(n) term for the new one
+        self.sum_nlogn += nlog2n(new) - nlog2n(old)
+        self.counts[token] = new
+        self.total += count
+
+        return self
+
+    def merge(self, other):
+        """Arguments:
+                other:  StreamingEntropy, e.g. from another part of the
+                    stream
+           returns:
+                self, updated to hold the counts of both estimators"""
+
+        for token, count in other.counts.items():
+            self.add(token, count)
+
+        return self
+
+    def entropy(self):
+        """returns:
+                HX:  float, the entropy of the tokens seen so far"""
+
+        if self.total == 0:
+            return 0.0
+
+        HX = log2(self.total) - self.sum_nlogn / self.total
+
+        # Rounding can leave a tiny negative value when only one distinct
+        # token has been seen
+        return max(HX, 0.0)
+
+    def frequencies(self):
+        """returns:
+                frequencies:  list, the count of each distinct token seen"""
+
+        return list(self.counts.values())
+
+
+class CountMinSketch(object):
+    """Approximate, fixed-memory token counts for corpora with too many
+    distinct tokens to count exactly.
+
+    Counts are held in a depth x width table of integers (a Count-Min
+    sketch).  Each token is hashed to one cell in every row; a token's
+    count is estimated as the smallest of its cells, which can only
+    over-count, by at most about e * total / width with probability
+    1 - exp(-depth).  The heavy_hitters most frequent tokens are tracked
+    by name.
+
+    Sketches built with the same width, depth and seed can be merged, so
+    each worker can count one shard of a corpus and the results are then
+    reduced, e.g.
+
+        sketches = pool.map(count_shard, shards)
+        total = reduce(CountMinSketch.merge, sketches)
+        HX = entropy_from_frequencies(total)
+
+    Like StreamingEntropy, a sketch pickles, so it can be returned from a
+    multiprocessing worker."""
+
+    # A Mersenne prime for the row hash functions (a * h + b) % PRIME
+    PRIME = 2 ** 31 - 1
+
+    def __init__(self, width=2 ** 16, depth=4, heavy_hitters=1000, seed=0):
+        """Arguments:
+                width:  integer, the number of cells in each row
+                depth:  integer, the number of rows (hash functions)
+                heavy_hitters:  integer, the number of most frequent
+                    tokens to track
+                seed:  integer, chooses the hash functions.  Sketches
+                    must share it to be merged."""
+
+        self.width = width
+        self.depth = depth
+        self.heavy_hitters = heavy_hitters
+        self.seed = seed
+
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+        self.top = {}
+        self.floor = 0
+
+        # Choose the row hash functions from the seed, so that every
+        # process builds the same ones.
+        rng = np.random.RandomState(seed)
+        self.hash_a = rng.randint(1, self.PRIME, size=depth).astype(np.int64)
+        self.hash_b = rng.randint(0, self.PRIME, size=depth).astype(np.int64)
+
+    def cells(self, tokens):
+        """Arguments:
+                tokens:  list, the tokens to hash
+           returns:
+                columns:  depth x len(tokens) array, the column of each
+                    token in each row"""
+
+        # Python's own hash() of a string differs between processes, so
+        # use crc32 of the token's repr, which does not.
+        h = np.array([zlib.crc32(repr(token).encode('utf-8')) % self.PRIME
+                      for token in tokens], dtype=np.int64)
+
+        # Every row hashes the whole batch at once.  a and h are both below
+        # 2**31, so a * h + b cannot overflow 64 bits.
+        return ((self.hash_a[:, np.newaxis] * h + self.hash_b[:, np.newaxis])
+                % self.PRIME % self.width)
+
+    def update(self, tokens):
+        """Arguments:
+                tokens:  iterable, the next batch of tokens
+           returns:
+                self, so calls can be chained"""
+
+        return self.add_counts(Counter(tokens))
+
+    def add(self, token, count=1):
+        """Arguments:
+                token:  the token seen
+                count:  integer, the number of times it was seen
+           returns:
+                self, so calls can be chained"""
+
+        return self.add_counts({token: count})
+
+    def add_counts(self, counts):
+        """Arguments:
+                counts:  dict, the number of times each token was seen
+           returns:
+                self, so calls can be chained"""
+
+        if not counts:
+            return self
+
+        tokens = list(counts)
+        weights = np.array([counts[token] for token in tokens],
+                           dtype=np.int64)
+
+        # Hash the distinct tokens of the batch in one pass.  np.add.at
+        # adds up tokens that land in the same cell, where plain fancy
+        # indexing would keep only one of them.
+        rows = np.arange(self.depth)[:, np.newaxis]
+        columns = self.cells(tokens)
+        np.add.at(self.table, (rows, columns), weights)
+        self.total += int(weights.sum())
+
+        estimates = self.table[rows, columns].min(axis=0)
+        self.track(tokens, estimates)
+
+        return self
+
+    def track(self, tokens, estimates):
+        """Record tokens as heavy hitters if their estimates are among the
+        largest seen, evicting the smallest tracked tokens if needed.
+
+        self.floor is a lower bound on the smallest tracked estimate.  It
+        is only brought up to date when tokens are evicted, which is
+        enough to turn away most tokens without looking at the others."""
+
+        # A token at or below the floor can neither join the heavy hitters
+        # nor raise the estimate of one already tracked.
+        for index in np.flatnonzero(estimates > self.floor):
+            self.top[tokens[index]] = int(estimates[index])
+
+        if len(self.top) > self.heavy_hitters:
+            kept = heapq.nlargest(self.heavy_hitters, self.top.items(),
+                                  key=lambda item: item[1])
+            self.top = dict(kept)
+            self.floor = kept[-1][1]
+
+    def estimate(self, token):
+        """Arguments:
+                token:  the token to look up
+           returns:
+                count:  integer, an upper bound on the count of token"""
+
+        rows = np.arange(self.depth)
+
+        return int(self.table[rows, self.cells([token])[:, 0]].min())
+
+    def merge(self, other):
+        """Arguments:
+                other:  CountMinSketch, built with the same width, depth
+                    and seed
+           returns:
+                self, updated to hold the counts of both sketches"""
+
+        if (self.width, self.depth, self.seed) != \
+                (other.width, other.depth, other.seed):
+            raise ValueError('Sketches have different shapes or seeds')
+
+        self.table += other.table
+        self.total += other.total
+
+        # The heavy hitters of the union are among the heavy hitters of
+        # the parts.  Re-estimate them all from the merged table.
+        candidates = list(set(self.top) | set(other.top))
+        self.top = {}
+        self.floor = 0
+        if candidates:
+            rows = np.arange(self.depth)[:, np.newaxis]
+            estimates = self.table[rows, self.cells(candidates)].min(axis=0)
+            self.track(candidates, estimates)
+
+        return self
+
+    def frequencies(self):
+        """returns:
+                frequencies:  list, the estimated count of each heavy
+                    hitter, followed by the counts of the other tokens
+                    grouped by their cell in the first row of the table.
+
+        Tokens outside the heavy hitters that share a cell are counted
+        together, so the entropy of these frequencies is slightly low when
+        the number of distinct tokens approaches the width."""
+
+        # Start from the first row and take out the heavy hitters, which
+        # are listed separately.
+        rest = self.table[0].copy()
+        frequencies = []
+        tokens = list(self.top)
+        columns = self.cells(tokens)[0] if tokens else []
+        for token, column in zip(tokens, columns):
+            count = min(self.top[token], rest[column])
+            rest[column] -= count
+            frequencies.append(count)
+
+        frequencies.extend(rest[rest > 0])
+
+        return frequencies
+
+
 def diff_entropy_from_frequencies(distribution, binsize):
     """Arguments:
             distribution:  iterable, a frequency distribution
@@ -108,6 +489,263 @@ def diff_entropy_from_frequencies(distribution, binsize):
     return HX
 
 
+def binned_frequencies(sorted_sample, binwidth, numbins):
+    """Arguments:
+            sorted_sample:  sorted numpy array of real values
+            binwidth:  float, the width of each bin
+            numbins:  integer, the number of bins, centred on zero
+       returns:
+            frequencies:  int array, the number of values in each bin.
+                Values with abs(x) >= binwidth * numbins / 2 are left out,
+                as in infotheory5_2.
+
+    Because the sample is sorted, each bin edge is found by binary search,
+    so no truncated copy of the sample is made."""
+
+    sdrange = binwidth * numbins / 2.0
+    binedges = np.arange(numbins + 1) * binwidth - sdrange
+
+    # The position of each edge in the sample.  Values equal to -sdrange
+    # are left out of the first bin, like those equal to sdrange.
+    positions = np.searchsorted(sorted_sample, binedges, 'left')
+    positions[0] = np.searchsorted(sorted_sample, binedges[0], 'right')
+
+    return np.diff(positions)
+
+
+def diff_entropies_from_sample(sample, bins):
+    """Arguments:
+            sample:  iterable or array of real values
+            bins:  list of (binwidth, numbins) pairs, as for
+                binned_frequencies
+       returns:
+            HX:  array, the entropy of the histogram for each pair
+            Hdiff:  array, the differential entropy for each pair
+                (Eq. 5.18 P 116)
+
+    The sample is sorted once and every histogram is counted from the
+    sorted copy."""
+
+    sorted_sample = np.sort(to_array(sample))
+
+    HX = []
+    Hdiff = []
+    for binwidth, numbins in bins:
+        frequencies = binned_frequencies(sorted_sample, binwidth, numbins)
+        HX.append(entropy_from_frequencies(frequencies))
+        Hdiff.append(diff_entropy_from_frequencies(frequencies, binwidth))
+
+    return np.array(HX), np.array(Hdiff)
+
+
+class StreamingHistogram(object):
+    """Fixed-memory histogram of a stream of real values, for estimating
+    differential entropy from data that never fits in memory.
+
+    The histogram has numbins bins of width binwidth starting at low.
+    Chunks of values (arrays or any iterable) are counted with update(),
+    and entropy() and diff_entropy() (Eq. 5.18 P 116) can be read at any
+    time.  Values below or above the bins are not dropped, but counted in
+    underflow and overflow.
+
+    With adaptive=True the bins move and widen to hold every value: when a
+    value falls outside them, the bins are shifted if the counts leave
+    room, and otherwise neighbouring pairs of bins are merged, doubling
+    binwidth, until it fits.  The bin edges always lie on the grid
+    low + k * binwidth, so memory stays fixed at numbins counts.
+
+    Histograms built with the same binwidth, numbins, low and adaptive
+    setting can be merged, so workers can each count part of a stream,
+    e.g.
+
+        histograms = pool.map(count_part, parts)
+        total = reduce(StreamingHistogram.merge, histograms)
+        print total.diff_entropy()"""
+
+    def __init__(self, binwidth, numbins, low=None, adaptive=False):
+        """Arguments:
+                binwidth:  float, the width of each bin
+                numbins:  integer, the number of bins
+                low:  float, the lower edge of the first bin.  Defaults to
+                    -binwidth * numbins / 2, centring the bins on zero as
+                    in infotheory5_2.
+                adaptive:  boolean, whether the bins move and widen to
+                    hold every value"""
+
+        if numbins < 2:
+            raise ValueError('A histogram needs at least 2 bins')
+
+        if low is None:
+            low = -binwidth * numbins / 2.0
+
+        self.origin = float(low)
+        self.base_binwidth = float(binwidth)
+        self.numbins = numbins
+        self.adaptive = adaptive
+
+        # The bins cover grid cells offset to offset + numbins - 1, where
+        # cell k is [origin + k * binwidth, origin + (k + 1) * binwidth)
+        # and binwidth is base_binwidth * 2 ** level.
+        self.binwidth = self.base_binwidth
+        self.level = 0
+        self.offset = 0
+
+        self.counts = np.zeros(numbins, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    def update(self, values):
+        """Arguments:
+                values:  array or iterable, the next chunk of real values
+           returns:
+                self, so calls can be chained"""
+
+        values = to_array(values)
+
+        if np.isnan(values).any():
+            raise ValueError('NaN in stream')
+
+        finite = values[np.isfinite(values)]
+        if self.adaptive and len(finite):
+            self.cover(finite.min(), finite.max())
+
+        low_edge, high_edge = self.edges()[[0, -1]]
+        below = values < low_edge
+        above = values >= high_edge
+        self.underflow += int(below.sum())
+        self.overflow += int(above.sum())
+
+        # Bin the rest in one operation.  Clipping only moves values lying
+        # within rounding error of the outer edges.
+        inside = values[~(below | above)]
+        indices = np.floor((inside - low_edge) / self.binwidth)
+        indices = np.clip(indices, 0, self.numbins - 1).astype(np.int64)
+
+        self.counts += np.bincount(indices, minlength=self.numbins)
+
+        return self
+
+    def cover(self, low, high):
+        """Move and widen the bins until they hold both the values low to
+        high and every value counted so far."""
+
+        occupied = np.flatnonzero(self.counts)
+
+        while True:
+            first = int(math.floor((low - self.origin) / self.binwidth))
+            last = int(math.floor((high - self.origin) / self.binwidth))
+            if len(occupied):
+                first = min(first, self.offset + occupied[0])
+                last = max(last, self.offset + occupied[-1])
+
+            if last - first < self.numbins:
+                break
+
+            self.coarsen()
+            occupied = np.flatnonzero(self.counts)
+
+        # Move the bins as little as possible
+        self.shift(min(max(self.offset, last - self.numbins + 1), first))
+
+    def coarsen(self):
+        """Merge neighbouring pairs of grid cells, doubling binwidth."""
+
+        cells = self.offset + np.arange(self.numbins)
+        offset = self.offset // 2
+
+        counts = np.zeros_like(self.counts)
+        np.add.at(counts, cells // 2 - offset, self.counts)
+
+        self.counts = counts
+        self.offset = offset
+        self.level += 1
+        self.binwidth *= 2
+
+    def shift(self, offset):
+        """Move the bins to start at grid cell offset.  Only empty bins may
+        be moved out."""
+
+        step = offset - self.offset
+        counts = np.zeros_like(self.counts)
+        if 0 <= step < self.numbins:
+            counts[:self.numbins - step] = self.counts[step:]
+        elif -self.numbins < step < 0:
+            counts[-step:] = self.counts[:self.numbins + step]
+
+        self.counts = counts
+        self.offset = offset
+
+    def merge(self, other):
+        """Arguments:
+                other:  StreamingHistogram, built with the same binwidth,
+                    numbins, low and adaptive setting
+           returns:
+                self, updated to hold the counts of both histograms"""
+
+        if (self.base_binwidth, self.numbins, self.origin, self.adaptive) != \
+                (other.base_binwidth, other.numbins, other.origin,
+                 other.adaptive):
+            raise ValueError('Histograms have different bins')
+
+        # Bring both histograms to the coarser grid, leaving other as it
+        # was
+        other = copy.deepcopy(other)
+        while self.level < other.level:
+            self.coarsen()
+
+        occupied = np.flatnonzero(other.counts)
+        if self.adaptive and len(occupied):
+            # Cover the centres of the first and last bins used by other
+            centres = self.origin + other.binwidth * \
+                (other.offset + occupied[[0, -1]] + 0.5)
+            self.cover(centres[0], centres[1])
+
+        while other.level < self.level:
+            other.coarsen()
+        other.shift(self.offset)
+
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+
+        return self
+
+    def edges(self):
+        """returns:
+                edges:  array, the numbins + 1 bin edges"""
+
+        cells = self.offset + np.arange(self.numbins + 1)
+
+        return self.origin + cells * self.binwidth
+
+    def frequencies(self):
+        """returns:
+                frequencies:  array, the count in each bin"""
+
+        return self.counts
+
+    def entropy(self):
+        """returns:
+                HX:  float, the entropy of the histogram of the values
+                    counted so far, leaving out underflow and overflow"""
+
+        if not self.counts.any():
+            return 0.0
+
+        return entropy_from_frequencies(self.counts)
+
+    def diff_entropy(self):
+        """returns:
+                Hdiff:  float, the differential entropy of the values
+                    counted so far (Eq. 5.18 P 116), or nan if none are
+                    in the bins yet"""
+
+        if not self.counts.any():
+            return float('nan')
+
+        return diff_entropy_from_frequencies(self.counts, self.binwidth)
+
+
 def row_totals(distribution):
     """Arguments:
             distribution:  a list of lists.  A 2D array.
@@ -157,30 +795,520 @@ def flatten(distribution):
     return flatlist
 
 
+class JointDistribution(object):
+    """The joint distribution of any number of discrete variables, held as
+    an array of counts (or probabilities) with one axis per variable.
+
+    Marginals and entropies are calculated only when asked for, and cached
+    until the counts are changed with update or add.  (Change the counts
+    through these methods, so the cache is cleared.)
+
+    Variables are referred to by axis number, e.g. for Table 4.1 with
+    output Y along the rows and input X along the columns
+
+        joint = JointDistribution(distribution)
+        HX = joint.entropy(1)
+        IXY = joint.mutual_information(0, 1)"""
+
+    def __init__(self, counts):
+        """Arguments:
+                counts:  array-like, or list of lists, of non-negative
+                    counts or probabilities, one axis per variable"""
+
+        self.counts = np.array(counts, dtype=float)
+        if self.counts.size and self.counts.min() < 0:
+            raise ValueError('Negative frequency')
+        self.cache = {}
+
+    @property
+    def ndim(self):
+        """The number of variables"""
+
+        return self.counts.ndim
+
+    def update(self, index, count=1):
+        """Arguments:
+                index:  tuple, one value for each variable
+                count:  the amount to add to that cell"""
+
+        self.counts[index] += count
+        self.cache.clear()
+
+    def add(self, counts):
+        """Arguments:
+                counts:  array of the same shape as this distribution, to
+                    add cell by cell"""
+
+        self.counts += counts
+        self.cache.clear()
+
+    def variables(self, axes):
+        """Returns axes (an axis number, a list of them, or None for all
+        the variables) as a sorted tuple of axis numbers."""
+
+        if axes is None:
+            return tuple(range(self.ndim))
+
+        if isinstance(axes, (int, np.integer)):
+            axes = (axes, )
+
+        return tuple(sorted(set(axes)))
+
+    def marginal(self, axes):
+        """Arguments:
+                axes:  the variables to keep
+           returns:
+                counts:  array, the counts summed over all other variables,
+                    with the kept variables in axis order"""
+
+        axes = self.variables(axes)
+        key = ("marginal", axes)
+        if key not in self.cache:
+            others = tuple(axis for axis in range(self.ndim)
+                           if axis not in axes)
+            self.cache[key] = self.counts.sum(axis=others)
+
+        return self.cache[key]
+
+    def entropy(self, axes=None):
+        """Arguments:
+                axes:  the variables, e.g. 0 for H(X0) or [0, 1] for
+                    H(X0,X1).  Defaults to all of them.
+           returns:
+                H:  float, their joint entropy"""
+
+        axes = self.variables(axes)
+        if not axes:
+            return 0.0
+
+        key = ("entropy", axes)
+        if key not in self.cache:
+            self.cache[key] = entropy_from_frequencies(self.marginal(axes))
+
+        return self.cache[key]
+
+    def conditional_entropy(self, axes, given):
+        """Returns H(axes | given), e.g. conditional_entropy(1, 0) is
+        H(X1|X0) = H(X0,X1) - H(X0)."""
+
+        given = self.variables(given)
+        both = self.variables(self.variables(axes) + given)
+
+        return self.entropy(both) - self.entropy(given)
+
+    def mutual_information(self, first, second, given=()):
+        """Returns I(first; second | given), e.g. mutual_information(0, 1)
+        is I(X0;X1) = H(X0) + H(X1) - H(X0,X1).  With given, this is the
+        conditional mutual information
+            H(first,given) + H(second,given) - H(first,second,given)
+            - H(given)."""
+
+        first = self.variables(first)
+        second = self.variables(second)
+        given = self.variables(given)
+
+        return (self.entropy(first + given) + self.entropy(second + given) -
+                self.entropy(first + second + given) - self.entropy(given))
+
+    def total_correlation(self, axes=None):
+        """Returns the total correlation of the variables, the sum of their
+        entropies less their joint entropy.  For two variables this is
+        their mutual information."""
+
+        axes = self.variables(axes)
+
+        return sum(self.entropy(axis) for axis in axes) - self.entropy(axes)
+
+    def interaction_information(self, axes=None):
+        """Returns the interaction information of the variables, the sum
+        over every non-empty subset T of them of (-1)^(|T| + 1) H(T).  For
+        two variables this is their mutual information; for three it is
+        I(X;Y) - I(X;Y|Z)."""
+
+        axes = self.variables(axes)
+
+        total = 0.0
+        for size in range(1, len(axes) + 1):
+            sign = 1.0 if size % 2 else -1.0
+            for subset in itertools.combinations(axes, size):
+                total += sign * self.entropy(subset)
+
+        return total
+
+
+class SparseJointDistribution(object):
+    """The joint distribution of two discrete variables X (axis 0) and Y
+    (axis 1) with too many values for a dense table, e.g. word pair
+    co-occurrences.
+
+    Each value of X and of Y is given an integer code 0, 1, 2, ... as it
+    is first seen.  Only the non-zero cells are stored, in coordinate (COO)
+    form: a sorted array of cell keys x_code * KEY_SPAN + y_code and an
+    array of their counts, 16 bytes per cell.  The marginal counts and the
+    entropies are calculated from these arrays alone.  The pairs can be
+    streamed in:
+
+        joint = SparseJointDistribution()
+        for chunk in pair_chunks:
+            joint.update(chunk)
+        IXY = joint.mutual_information()
+
+    Each chunk is counted with np.unique and held back as a sorted run.
+    Once the runs held back add up to as many cells as are stored, they
+    are all merged into the stored cells in one sort.  The stored cells
+    at least double between merges unless the chunks repeat cells already
+    seen, so each pair is sorted only a few times however long the stream
+    is.  A query merges whatever is held back first.  As with
+    JointDistribution, results are cached until update is called."""
+
+    # Codes of Y must be below KEY_SPAN, so that each cell key is unique
+    KEY_SPAN = 2 ** 32
+
+    # Pairs read at a time from an iterable
+    CHUNK_SIZE = 2 ** 16
+
+    def __init__(self, pairs=()):
+        """Arguments:
+                pairs:  optional iterable of (x, y) pairs, as for update"""
+
+        self.codes = ({}, {})
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0)
+        self.pending = []
+        self.pending_size = 0
+        self.cache = {}
+
+        self.update(pairs)
+
+    @classmethod
+    def from_coo(cls, rows, cols, counts):
+        """Arguments:
+                rows, cols:  arrays, the x and y value of each non-zero
+                    cell, e.g. the row, col attributes of a scipy.sparse
+                    coo_matrix
+                counts:  array, the count in each cell (its data)
+           returns:
+                joint:  SparseJointDistribution"""
+
+        joint = cls()
+        joint.add_codes(joint.encode(0, np.asarray(rows)),
+                        joint.encode(1, np.asarray(cols)),
+                        np.asarray(counts, dtype=float))
+
+        return joint
+
+    def update(self, pairs):
+        """Arguments:
+                pairs:  iterable of (x, y) pairs, which is read lazily in
+                    chunks, or an (n, 2) numpy array of them
+           returns:
+                self, so calls can be chained"""
+
+        if isinstance(pairs, np.ndarray):
+            if len(pairs):
+                self.add_codes(self.encode(0, pairs[:, 0]),
+                               self.encode(1, pairs[:, 1]))
+            return self
+
+        pairs = iter(pairs)
+        while True:
+            chunk = list(itertools.islice(pairs, self.CHUNK_SIZE))
+            if not chunk:
+                return self
+
+            # Python values may be of mixed types, which an array would
+            # turn into strings, so look them up one at a time
+            x_codes, y_codes = self.codes
+            xs = [x_codes.setdefault(x, len(x_codes)) for x, _ in chunk]
+            ys = [y_codes.setdefault(y, len(y_codes)) for _, y in chunk]
+            self.add_codes(np.array(xs, dtype=np.int64),
+                           np.array(ys, dtype=np.int64))
+
+    def encode(self, axis, values):
+        """Arguments:
+                axis:  0 for X or 1 for Y
+                values:  1D array of values of that variable
+           returns:
+                codes:  int64 array, the code of each value.  Values not
+                    seen before are given new codes."""
+
+        uniques, inverse = np.unique(values, return_inverse=True)
+
+        # Only the distinct values of the chunk go through the dictionary
+        table = self.codes[axis]
+        mapped = np.array([table.setdefault(value, len(table))
+                           for value in uniques.tolist()], dtype=np.int64)
+
+        return mapped[inverse.ravel()]
+
+    def add_codes(self, xs, ys, weights=None):
+        """Add a count of weights (default 1) to each cell (xs, ys) given
+        by code."""
+
+        if len(self.codes[1]) > self.KEY_SPAN:
+            raise ValueError('Too many distinct values of Y')
+
+        keys, inverse = np.unique(xs * self.KEY_SPAN + ys,
+                                  return_inverse=True)
+        counts = np.bincount(inverse.ravel(), weights=weights,
+                             minlength=len(keys)).astype(float)
+
+        # Hold the chunk back until enough cells are waiting to make a
+        # merge worth its cost
+        self.pending.append((keys, counts))
+        self.pending_size += len(keys)
+        if self.pending_size >= max(len(self.keys), self.CHUNK_SIZE):
+            self.merge_pending()
+
+        self.cache.clear()
+
+    def merge_pending(self):
+        """Merge the runs of cells held back by add_codes into the stored
+        cells, adding up the counts of cells that appear more than once."""
+
+        if not self.pending:
+            return
+
+        keys = np.concatenate([self.keys] + [k for k, _ in self.pending])
+        counts = np.concatenate([self.counts] + [c for _, c in self.pending])
+
+        self.keys, inverse = np.unique(keys, return_inverse=True)
+        self.counts = np.bincount(inverse.ravel(), weights=counts,
+                                  minlength=len(self.keys))
+
+        self.pending = []
+        self.pending_size = 0
+
+    def coo(self):
+        """returns:
+                xs, ys:  int arrays, codes for the x and y value of each
+                    non-zero cell
+                counts:  float array, the count in each cell"""
+
+        if "coo" not in self.cache:
+            self.merge_pending()
+            self.cache["coo"] = (self.keys // self.KEY_SPAN,
+                                 self.keys % self.KEY_SPAN, self.counts)
+
+        return self.cache["coo"]
+
+    def values(self, axis):
+        """Arguments:
+                axis:  0 for X or 1 for Y
+           returns:
+                values:  list, the value with each code of that variable"""
+
+        table = self.codes[axis]
+        values = [None] * len(table)
+        for value, code in table.items():
+            values[code] = value
+
+        return values
+
+    def marginal(self, axis):
+        """Arguments:
+                axis:  0 for X or 1 for Y
+           returns:
+                counts:  array, the total count of each value of that
+                    variable"""
+
+        key = ("marginal", axis)
+        if key not in self.cache:
+            xs, ys, counts = self.coo()
+            self.cache[key] = np.bincount((xs, ys)[axis], weights=counts,
+                                          minlength=len(self.codes[axis]))
+
+        return self.cache[key]
+
+    def entropy(self, axes=None):
+        """Arguments:
+                axes:  0 for H(X), 1 for H(Y), or None (or [0, 1]) for
+                    H(X,Y)
+           returns:
+                H:  float, the entropy"""
+
+        if axes in (0, 1, [0], [1], (0, ), (1, )):
+            axis = axes if axes in (0, 1) else axes[0]
+            frequencies = self.marginal(axis)
+            key = ("entropy", axis)
+        else:
+            frequencies = self.coo()[2]
+            key = ("entropy", None)
+
+        if key not in self.cache:
+            self.cache[key] = entropy_from_frequencies(frequencies)
+
+        return self.cache[key]
+
+    def conditional_entropy(self, axis=1, given=0):
+        """Returns H(Y|X) for the defaults, or H(X|Y) for axis=0, given=1,
+        as H(X,Y) less the entropy of the given variable."""
+
+        if axis == given:
+            return 0.0
+
+        return self.entropy() - self.entropy(given)
+
+    def mutual_information(self):
+        """Returns I(X;Y) = H(X) + H(Y) - H(X,Y)."""
+
+        return self.entropy(0) + self.entropy(1) - self.entropy()
+
+
+def pairwise_mutual_information(data, processes=None, output_path=None):
+    """Calculates I(X_i; X_j) for every pair of columns of a data set of
+    discrete features.
+
+    Each column is encoded once as integer codes 0, 1, ..., k - 1, and its
+    entropy H(X_i) is calculated once.  The joint values of a pair are
+    then encoded as the single integer code_i * k_j + code_j and counted
+    with array operations, so I(X_i; X_j) = H(X_i) + H(X_j) - H(X_i,X_j)
+    needs one joint entropy per pair.  Rows of the matrix are shared out
+    to a pool of worker processes, which write straight into a
+    memory-mapped output matrix.
+
+       Arguments:
+            data:  2D array (samples x features) of discrete values
+            processes:  integer, the number of worker processes.  Defaults
+                to the number of cores; 1 runs without a pool.
+            output_path:  optional string.  If given, the matrix is kept
+                there as a .npy file that can be opened with
+                np.load(output_path, mmap_mode="r").
+       returns:
+            MI:  array (features x features), MI[i, j] = I(X_i; X_j).  The
+                diagonal holds the entropies H(X_i) = I(X_i; X_i)."""
+
+    data = np.asarray(data)
+    features = data.shape[1]
+
+    # Encode every column, and count how many values each one has
+    codes = np.empty(data.shape, dtype=np.int64)
+    sizes = np.empty(features, dtype=np.int64)
+    for col in range(features):
+        values, codes[:, col] = np.unique(data[:, col], return_inverse=True)
+        sizes[col] = len(values)
+
+    entropies = np.array([
+        entropy_from_frequencies(np.bincount(codes[:, col]))
+        for col in range(features)])
+
+    keep = output_path is not None
+    if not keep:
+        handle, output_path = tempfile.mkstemp(suffix=".npy")
+        os.close(handle)
+
+    try:
+        matrix = np.lib.format.open_memmap(output_path, mode="w+",
+                                           dtype=np.float64,
+                                           shape=(features, features))
+        matrix[np.diag_indices(features)] = entropies
+        matrix.flush()
+        del matrix
+
+        state = (codes, sizes, entropies, output_path)
+        if processes == 1:
+            set_pairwise_state(*state)
+            for row in range(features):
+                pairwise_row(row)
+        else:
+            pool = multiprocessing.Pool(processes,
+                                        initializer=set_pairwise_state,
+                                        initargs=state)
+            try:
+                pool.map(pairwise_row, range(features))
+            finally:
+                pool.close()
+                pool.join()
+
+        if keep:
+            return np.load(output_path, mmap_mode="r")
+
+        return np.load(output_path)
+    finally:
+        if not keep:
+            os.remove(output_path)
+
+
+# The data shared with pairwise_row in each worker process
+PAIRWISE_STATE = None
+
+
+def set_pairwise_state(codes, sizes, entropies, output_path):
+    """Worker initializer for pairwise_mutual_information."""
+
+    global PAIRWISE_STATE
+    PAIRWISE_STATE = (codes, sizes, entropies, output_path)
+
+
+def pairwise_row(row):
+    """Worker for pairwise_mutual_information.  Calculates I(X_row; X_j)
+    for every column j after row, and writes it to both halves of the
+    output matrix."""
+
+    codes, sizes, entropies, output_path = PAIRWISE_STATE
+    matrix = np.load(output_path, mmap_mode="r+")
+
+    for col in range(row + 1, len(sizes)):
+        joint = codes[:, row] * sizes[col] + codes[:, col]
+
+        # Count a small table with bincount; for a large table, only count
+        # the pairs that occur
+        if sizes[row] * sizes[col] <= 4 * len(joint):
+            frequencies = np.bincount(joint)
+        else:
+            _, frequencies = np.unique(joint, return_counts=True)
+
+        IXY = entropies[row] + entropies[col] - \
+            entropy_from_frequencies(frequencies)
+        matrix[row, col] = matrix[col, row] = IXY
+
+    matrix.flush()
+
+
 def valid_probabilities(distribution):
     """Arguments:
-            distribution:  a list of probabilities.
+            distribution:  a list or array of probabilities.
        returns:
-            probabilities, list of valid probabilities. It removes zero values.
+            probabilities, array of valid probabilities. It removes zero
+            values.
 
     All values should be positive.  The sum of the
     probabilities should be equal to 1.0 to 2 decimal places. """
 
+    distribution = to_array(distribution)
+
     # Check the probabilities sum to 1.00 to 2 decimal places
-    if round(sum(distribution), 2) != 1.0:
+    if round(distribution.sum(), 2) != 1.0:
         raise ValueError('Probabilities do not sum to 1')
 
     # Check we have no negative values
-    if min(distribution) < 0:
+    if distribution.min() < 0:
         raise ValueError('Negative probability')
 
-    # Make a list of the probabilities in distribution where
+    # Keep the probabilities in distribution where
     # the probability is greater than zero
-    probabilities = [p for p in distribution if p > 0]
+    probabilities = distribution[distribution > 0]
 
     return probabilities
 
 
+def to_array(values):
+    """Arguments:
+            values:  iterable or array of numbers, e.g. a list, the
+                values() of a Counter, or a numpy array
+       returns:
+            array:  1D numpy float array holding the passed values"""
+
+    # Lists, tuples and arrays convert directly.  Anything else (e.g.
+    # dict values or a generator) is read into a list first.
+    if not isinstance(values, (np.ndarray, list, tuple)):
+        values = list(values)
+
+    array = np.asarray(values, dtype=float).ravel()
+
+    return array
+
+
 def log2(posval):
     """Arguments:
             posval:  a postive number
@@ -208,41 +1336,338 @@ def strrounddp(num, decimal_p):
     return result
 
 
-def cumulative_gaussian(x, mu=0.0, sigma=1.0):
+def cumulative_gaussian(x, mu=0.0, sigma=1.0, log=False):
     """The cumulative Gaussian at x, for the distribution with mean mu and
     standard deviation sigma.
     Parameters
     ----------
     x : float or array
        The values of x over which to evaluate the cumulative Gaussian function
-    mu : float
+    mu : float or array
        The mean parameter. Determines the x value at which the y value is 0.5
-    sigma : float
+    sigma : float or array
        The variance parameter. Determines the slope of the curve at
        the point of Deflection
+    log : boolean
+       Return the natural log of the cumulative Gaussian, which stays
+       accurate far into the lower tail, where the value itself is too
+       small for a float
     Returns
     -------
+    y : float or array
+       The cumulative Gaussian (or its log) at each x, with x, mu and
+       sigma broadcast together
     Notes
     -----
     Based on:
     http://en.wikipedia.org/wiki/Normal_distribution
                                     #Cumulative_distribution_function"""
 
-    t = x - mu
-    y = 0.5 * erfcc(-t / (sigma * math.sqrt(2.0)))
+    t = np.asarray(x, dtype=float) - mu
+    z = -t / (sigma * math.sqrt(2.0))
+
+    if log:
+        y = log_erfcc(z) - math.log(2.0)
+    else:
+        y = 0.5 * erfcc(z)
+
+    return y
 
-    return min(y, 1.0)
+
+# erfcc sums a series for erf below the first of these limits of abs(x).
+# From each limit up it evaluates the continued fraction for erfc to the
+# given number of terms, which is enough for double precision.
+ERF_SERIES_TERMS = 20
+ERFC_FRACTION_TERMS = ((1.0, 200), (2.0, 60), (4.0, 24))
 
 
 def erfcc(x):
-    """Complementary error function."""
-    z = abs(x)
-    t = 1.0 / (1.0 + 0.5 * z)
-    r = t * math.exp(-z * z - 1.26551223 + t * (1.00002368 + t * (.37409196 +
-        t * (0.09678418 + t * (-0.18628806 + t * (0.27886807 +
-        t * (-1.13520398 + t * (1.48851587 + t * (-0.82215223 +
-        t * 0.17087277)))))))))
-    if x >= 0.0:
-        return r
+    """Complementary error function, erfc(x) = 1 - erf(x), to double
+    precision.
+       Arguments:
+            x:  float or array
+       returns:
+            y:  float, or array of the same shape as x"""
+
+    x = np.asarray(x, dtype=float)
+    z = np.abs(x)
+
+    fraction, mantissa = erfc_mantissa(z)
+
+    with np.errstate(invalid='ignore'):
+        y = np.where(fraction, exp_minus_square(z) * mantissa, mantissa)
+    y[z == np.inf] = 0.0
+
+    # erfc(-x) = 2 - erfc(x)
+    y = np.where(x < 0, 2.0 - y, y)
+
+    if y.ndim == 0:
+        return float(y)
+
+    return y
+
+
+def log_erfcc(x):
+    """Natural log of the complementary error function.  For large x,
+    erfc(x) = exp(-x^2) * m with m of order 1 / x, so log(erfc(x)) =
+    -x^2 + log(m) is found without erfc(x) itself, which underflows to
+    zero beyond x = 27.
+       Arguments:
+            x:  float or array
+       returns:
+            y:  float, or array of the same shape as x"""
+
+    x = np.asarray(x, dtype=float)
+    z = np.abs(x)
+
+    fraction, mantissa = erfc_mantissa(z)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        y = np.log(mantissa) - np.where(fraction, z * z, 0.0)
+        y = np.where(x < 0, np.log(2.0 - erfcc(z)), y)
+
+    if y.ndim == 0:
+        return float(y)
+
+    return y
+
+
+def erfc_mantissa(z):
+    """Arguments:
+            z:  array of values >= 0
+       returns:
+            fraction:  boolean array, True where the continued fraction
+                was used
+            mantissa:  array, erfc(z) where fraction is False, and
+                exp(z^2) * erfc(z) where it is True"""
+
+    mantissa = np.full(z.shape, np.nan)
+
+    inside = z < ERFC_FRACTION_TERMS[0][0]
+    mantissa[inside] = 1.0 - erf_series(z[inside])
+
+    limits = [low for low, _ in ERFC_FRACTION_TERMS[1:]] + [np.inf]
+    for (low, terms), high in zip(ERFC_FRACTION_TERMS, limits):
+        inside = (z >= low) & (z <= high)
+        mantissa[inside] = erfc_fraction(z[inside], terms)
+
+    return z >= ERFC_FRACTION_TERMS[0][0], mantissa
+
+
+def erf_series(z):
+    """Error function for small z, from the series
+    erf(z) = 2 / sqrt(pi) * exp(-z^2) * sum(2^n z^(2n+1) / (1.3.5...(2n+1)))
+    whose terms are all positive."""
+
+    term = z.copy()
+    total = z.copy()
+    for n in range(1, ERF_SERIES_TERMS):
+        term *= 2.0 * z * z / (2 * n + 1)
+        total += term
+
+    return 2.0 / math.sqrt(math.pi) * np.exp(-z * z) * total
+
+
+def erfc_fraction(z, terms):
+    """exp(z^2) * erfc(z) for z >= 1, from the continued fraction
+    erfc(z) = exp(-z^2) / sqrt(pi) / (z + (1/2) / (z + (2/2) / (z + ...)))
+    evaluated from the inside out."""
+
+    denominator = z.copy()
+    for k in range(terms, 0, -1):
+        denominator = z + (k / 2.0) / denominator
+
+    return 1.0 / (math.sqrt(math.pi) * denominator)
+
+
+def exp_minus_square(z):
+    """exp(-z^2), without the rounding error of z * z, which is large
+    relative to exp(-z^2) for large z."""
+
+    # Split z into a part with few bits, whose square is exact, and the
+    # rest: z^2 = zr^2 + (z - zr)(z + zr)
+    zr = np.floor(z * 16.0) / 16.0
+
+    return np.exp(-zr * zr) * np.exp(-(z - zr) * (z + zr))
+
+
+def inverse_cumulative_gaussian(p, mu=0.0, sigma=1.0, log=False):
+    """The value x at which the cumulative Gaussian with mean mu and
+    standard deviation sigma equals p.
+       Arguments:
+            p:  float or array of probabilities, or of their natural logs
+                if log is True
+            mu, sigma:  float or array, as for cumulative_gaussian
+            log:  boolean, whether p holds natural logs of probabilities,
+                e.g. to reach probabilities too small for a float
+       returns:
+            x:  float, or array of p, mu and sigma broadcast together"""
+
+    log_p = np.asarray(p, dtype=float)
+    if not log:
+        with np.errstate(divide='ignore'):
+            log_p = np.log(log_p)
+
+    # Newton's method on log(Phi(x)) = log(p).  log(Phi) is concave, so
+    # after the first step every estimate lies below the root and the
+    # steps climb up to it without overshooting.
+    x = np.where(log_p < math.log(0.5), -np.sqrt(-2.0 * log_p), 0.0)
+    with np.errstate(invalid='ignore', over='ignore'):
+        for _ in range(100):
+            log_phi = cumulative_gaussian(x, log=True)
+            log_density = -0.5 * x * x - 0.5 * math.log(2.0 * math.pi)
+            step = (log_phi - log_p) / np.exp(log_density - log_phi)
+            step = np.where(np.isfinite(step), step, 0.0)
+            x = x - step
+            if np.all(np.abs(step) <= 1e-15 * (1.0 + np.abs(x))):
+                break
+
+    x = np.where(log_p == 0.0, np.inf, x)
+    x = np.where(log_p == -np.inf, -np.inf, x)
+    x = mu + sigma * x
+
+    if x.ndim == 0:
+        return float(x)
+
+    return x
+
+
+def error_probability(n, P, N, R, C=None, log=False, chunk_size=2 ** 18,
+                      out=None):
+    """The probability of a decoding error for messages of length n sent
+    over a Gaussian channel (Eq. 7.40 P159)
+
+        P(error) = Phi(sqrt(n * 2P(P + N) / (N(P + 2N))) * (R - C))
+
+    where Phi is the cumulative Gaussian.
+
+       Arguments:
+            n:  float or array, the message length
+            P:  float or array, the signal power
+            N:  float or array, the noise power
+            R:  float or array, the rate in bits per symbol
+            C:  float or array, the channel capacity in bits per symbol.
+                Defaults to 0.5 * log2(1 + P/N) (Eq. 7.18).
+            log:  boolean, return the natural log of P(error), which
+                stays accurate where P(error) is too small for a float
+            chunk_size:  integer, the number of grid points worked out
+                at a time, which bounds the memory used besides out
+            out:  optional array, e.g. a numpy.memmap, of the broadcast
+                shape to write the result into
+       returns:
+            perror:  float, or array of the arguments broadcast together,
+                e.g. n[:, None] and R[None, :] give a len(n) x len(R)
+                surface"""
+
+    arguments = [n, P, N, R] + ([] if C is None else [C])
+
+    return broadcast_chunks(
+        lambda *chunk: decoding_error(*chunk, log=log),
+        arguments, chunk_size, out)
+
+
+def decoding_error(n, P, N, R, C=None, log=False):
+    """Eq. 7.40 for 1D arrays of n, P, N, R and C, see error_probability"""
+
+    return cumulative_gaussian(np.sqrt(n) * error_slope(P, N, R, C), log=log)
+
+
+def error_slope(P, N, R, C=None):
+    """The factor of sqrt(n) inside Phi in Eq. 7.40, which is negative
+    when R is below C"""
+
+    if C is None:
+        # Eq. 7.18
+        C = 0.5 * np.log2(1.0 + P / N)
+
+    return np.sqrt((2.0 * P * (P + N)) / (N * (P + 2.0 * N))) * (R - C)
+
+
+def min_message_length(target, P, N, R, C=None, log=False,
+                       chunk_size=2 ** 18, out=None):
+    """The shortest message length n with an Eq. 7.40 error probability
+    no larger than target.
+       Arguments:
+            target:  float or array, the error probability wanted, or
+                its natural log if log is True
+            P, N, R, C:  float or array, as for error_probability
+            log:  boolean, whether target is a natural log
+            chunk_size, out:  as for error_probability
+       returns:
+            n:  float, or array of the arguments broadcast together.
+                n is a whole number, 0 where target is at least 0.5 and
+                inf where R is not below C, as then no n is long enough."""
+
+    arguments = [target, P, N, R] + ([] if C is None else [C])
+
+    return broadcast_chunks(
+        lambda *chunk: message_length_chunk(*chunk, log=log),
+        arguments, chunk_size, out)
+
+
+def message_length_chunk(target, P, N, R, C=None, log=False):
+    """min_message_length for 1D arrays of its arguments"""
+
+    if log:
+        log_target = target
     else:
-        return 2.0 - r
+        with np.errstate(divide='ignore'):
+            log_target = np.log(target)
+
+    # Eq. 7.40 is Phi(sqrt(n) * slope).  Solve it for n and round up.
+    slope = error_slope(P, N, R, C)
+    x = inverse_cumulative_gaussian(log_target, log=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        n = np.ceil((x / slope) ** 2)
+
+        # Rounding can leave n one out either way, so check it against
+        # the forward calculation
+        too_short = decoding_error(n, P, N, R, C, log=True) > log_target
+        n = np.where(too_short, n + 1, n)
+        long_enough = decoding_error(np.maximum(n - 1, 0), P, N, R, C,
+                                     log=True) <= log_target
+        n = np.where(long_enough & (n >= 1), n - 1, n)
+
+    n = np.where(slope >= 0, np.inf, n)
+    n = np.where(x >= 0, 0.0, n)
+
+    return n
+
+
+def broadcast_chunks(function, arguments, chunk_size, out=None):
+    """Evaluates function over arguments broadcast together, a chunk of
+    chunk_size grid points at a time, so that at most one chunk of each
+    argument and of function's working arrays is in memory at once.
+       Arguments:
+            function:  takes 1D arrays, one chunk of each argument, and
+                returns a 1D array of results
+            arguments:  list of floats or arrays
+            chunk_size:  integer, the grid points in each chunk
+            out:  optional array of the broadcast shape, e.g. a
+                numpy.memmap, to write the results into
+       returns:
+            out:  float, or array of the broadcast shape"""
+
+    shape = np.broadcast(*arguments).shape
+    if out is None:
+        out = np.empty(shape)
+    elif out.shape != shape:
+        raise ValueError('out has shape %s, not %s' % (out.shape, shape))
+
+    # Broadcasting gives views, so no full-size copy of any argument is
+    # made.  flat[start:end] copies out just one chunk.
+    grids = [np.broadcast_to(np.asarray(argument, dtype=float), shape)
+             for argument in arguments]
+
+    # Write through out.flat, which follows the grid order whatever the
+    # memory layout of out.  (out.reshape(-1) would silently copy an out
+    # that is not C-contiguous, and the results would be lost.)
+    for start in range(0, out.size, chunk_size):
+        end = min(start + chunk_size, out.size)
+        out.flat[start:end] = function(*[grid.flat[start:end]
+                                         for grid in grids])
+
+    if out.ndim == 0:
+        return float(out)
+
+    return out
@@ -16,42 +16,15 @@ https://www.youtube.com/watch?v=EnSu9hHGq5o
 """
 
 
-from collections import Counter
 import math
 
-
-def entropy_from_probabilities(probabilities):
-    """Returns the entropy of the passed probability distribution"""
-
-    if round(sum(probabilities), 2) != 1.0:
-        raise ValueError('Probabilities do not sum to 1 to 2 d.p.')
-
-    if min(probabilities) < 0:
-        raise ValueError('Negative probability')
-
-    # Eq 2.52 P37
-    return sum([px * log2(1.0/px) for px in probabilities if px > 0])
-
-
-def entropy_from_frequencies(frequencies):
-    """Returns the entropy of the passed frequency distribution"""
-
-    # Transform the frequencies to probabilities. The probability of
-    # an event is its frequency divided by the total of all frequencies.
-
-    total = sum(frequencies)
-
-    return entropy_from_probabilities([f / float(total) for f in frequencies])
-
-
-def entropy_from_sample(distribution):
-    """Returns the entropy of the passed distribution
-            distribution:  iterable, a sample distribution
-        e.g     [1,2,5,2,2,1,4,4,2,2,2,2]
-                ["A","B","C","B","B","A","D","D","B","B","B","B"]
-                ["H","T","H","T",,"H","H","H","H","H"]"""
-
-    return entropy_from_frequencies(Counter(distribution).values())
+# The entropy and cumulative Gaussian functions share the numpy backend of
+# information_theory.py, so both modules always give the same results.
+from information_theory import (entropy_from_probabilities,
+                                entropy_from_frequencies,
+                                entropy_from_sample,
+                                cumulative_gaussian,
+                                erfcc)
 
 
 def diff_entropy_from_frequencies(distribution, binsize):
@@ -98,43 +71,3 @@ def strrounddp(num, decimal_p):
         result = fmt % round(float(num), decimal_p)
 
     return result
-
-
-def cumulative_gaussian(x, mu=0.0, sigma=1.0):
-    """The cumulative Gaussian at x, for the distribution with mean mu and
-    standard deviation sigma.
-    Parameters
-    ----------
-    x : float or array
-       The values of x over which to evaluate the cumulative Gaussian function
-    mu : float
-       The mean parameter. Determines the x value at which the y value is 0.5
-    sigma : float
-       The variance parameter. Determines the slope of the curve at
-       the point of Deflection
-    Returns
-    -------
-    Notes
-    -----
-    Based on:
-    http://en.wikipedia.org/wiki/Normal_distribution
-                                    #Cumulative_distribution_function"""
-
-    t = x - mu
-    y = 0.5 * erfcc(-t / (sigma * math.sqrt(2.0)))
-
-    return min(y, 1.0)
-
-
-def erfcc(x):
-    """Complementary error function."""
-    z = abs(x)
-    t = 1.0 / (1.0 + 0.5 * z)
-    r = t * math.exp(-z * z - 1.26551223 + t * (1.00002368 + t * (.37409196 +
-        t * (0.09678418 + t * (-0.18628806 + t * (0.27886807 +
-        t * (-1.13520398 + t * (1.48851587 + t * (-0.82215223 +
-        t * 0.17087277)))))))))
-    if x >= 0.0:
-        return r
-    else:
-        return 2.0 - r
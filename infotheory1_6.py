@@ -17,6 +17,7 @@ Produces a graphic with title ending Entropy 7.838 bits
 from matplotlib import pyplot
 from PIL import Image
 import information_theory as it
+import image_entropy
 
 def main():
     """Main function for Figure 1.6b example"""
@@ -30,16 +31,9 @@ def main():
     pyplot.imshow(image, cmap='gray')
     pyplot.axis('off')
 
-    # Load all pixels as an iterable list
-    pixels = image.getdata()
-
-    # Zero our frequency list
-    frequencies = [0] * 256
-
-    # Loop over all pixels, incrementing the frequency for each greyscale
-    # value found
-    for pixel in pixels:
-        frequencies[pixel] += 1
+    # Count the number of pixels with each greyscale value.  This is done
+    # in one call, rather than looping over the pixels in Python.
+    frequencies = image_entropy.histogram(image)
 
     # Use these frequencies to calculate an entropy
     HX = it.entropy_from_frequencies(frequencies)
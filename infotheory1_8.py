@@ -13,9 +13,11 @@ the convolved image and plots the frequencies of the grey level differencs
 between adjacent pixels to reproduce fig 1.8b and calculates an entropy for
 this convolved image"""
 
+import numpy as np
 from matplotlib import pyplot
 from PIL import Image
 import information_theory as it
+import image_entropy
 
 def main():
     """Main function for Figure 1.8b example"""
@@ -32,33 +34,20 @@ def main():
     pyplot.imshow(image, cmap='gray')
     pyplot.axis('off')
 
-    # Get image size
-    xsize, ysize = image.size
+    # Calculate the grey level difference between each pixel and the pixel
+    # to its left, for the whole image at once.  The original image is not
+    # changed.
+    differences = image_entropy.difference_image(image, "horizontal")
 
-    # Zero our frequency list
-    frequencies = [0] * 511
-
-    # Load pixels
-    pixels = image.load()
-
-    # Loop over all pixels, incrementing the frequency for each greyscale
-    # value found.
-    # As we loop wwe will make the convolved image by updating the pixel
-    # just visited with the greyscale difference
-    for row in range(0, ysize):
-        for col in range(0, xsize - 1):
-            diff = pixels[col + 1, row] - pixels[col, row]
-            frequencies[diff+255] += 1
-            # Change the pixel held to be the difference
-            pixels[col, row] = diff + 127
-        pixels[xsize - 1, row] = 0
-
-    # Plot the convolved image
+    # Plot the convolved image.  Zero difference is shown as mid-grey.
     pyplot.subplot(2, 2, 2)
     pyplot.title("Convolved Image")
-    pyplot.imshow(image, cmap='gray')
+    pyplot.imshow(np.clip(differences + 127, 0, 255), cmap='gray')
     pyplot.axis('off')
 
+    # Count the frequency of each difference, from -255 to 255
+    frequencies = image_entropy.difference_histogram(image, "horizontal")
+
     # Use these frequencies to calculate an entropy
     HX = it.entropy_from_frequencies(frequencies)
 
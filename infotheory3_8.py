@@ -36,11 +36,21 @@ Produces  entropy for model order = 1 for romeo.txt of 3.463bits"""
 # ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import array
 import codecs
+import hashlib
+import itertools
+import json
+import mmap
+import multiprocessing
+import os
 import random
 import re
+import shutil
+import tempfile
 import textwrap
 from collections import defaultdict, deque, Counter
+import numpy as np
 import information_theory as it
 
 def main():
@@ -51,8 +61,9 @@ def main():
     
     filename = "romeo.txt"
 
-    # The entropy of characters
-    model = markov_model(chars(filename), model_order)
+    # The entropy of characters.  The model is cached on disk, so later
+    # runs on the same file and model order skip building it.
+    model = cached_markov_model(filename, chars, model_order)
 
     print "Letter Entropy:", entropy_rate(model), ' bits/letter.'
     print 'Model order = ', model_order
@@ -67,7 +78,7 @@ def main():
     #
     # The entropy of words
     #
-    model = markov_model(words(filename), model_order)
+    model = cached_markov_model(filename, words, model_order)
 
     print "\n\n"
     print "Word Entropy = :", entropy_rate(model), ' bits/word.'
@@ -134,6 +145,657 @@ def markov_model(stream, model_order):
     return model
 
 
+def parallel_markov_model(file_path, tokenizer, model_order, processes=None,
+                          chunk_size=32 * 1024 * 1024):
+    """Builds the same counts as markov_model(tokenize(file_path,
+    tokenizer), model_order), but splits the file into byte ranges and
+    counts them in a pool of worker processes.
+
+    Each worker returns its counts as integer arrays (see count_byte_range)
+    rather than a dict of Counters, so little has to be pickled.
+    Neighbouring partial counts are then merged in pairs, also in the pool,
+    until one is left, so no step runs over the whole file in this
+    process.
+
+       Arguments:
+            file_path:  string.  The path to the file to read in.
+            tokenizer: function.  A function to split up the data into
+                tokens, e.g. append_space or break_into_words
+            model_order:  integer, the length of the prefixes
+            processes:  integer, the number of worker processes.  Defaults
+                to the number of cores.
+            chunk_size:  integer, the approximate number of bytes read by
+                each task
+       returns:
+            model:  CompactMarkovModel, which behaves like the dict from
+                markov_model"""
+
+    chunks = byte_ranges(file_path, chunk_size)
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        partials = pool.map(
+            count_byte_range,
+            [(file_path, start, end, tokenizer, model_order)
+             for start, end in chunks])
+
+        # A tree reduction: merge ranges 0 and 1, 2 and 3, ... in file
+        # order, then the results of those, and so on.
+        while len(partials) > 1:
+            merged = pool.map(merge_partials,
+                              list(zip(partials[0::2], partials[1::2])))
+            if len(partials) % 2:
+                merged.append(partials[-1])
+            partials = merged
+    finally:
+        pool.close()
+        pool.join()
+
+    if not partials:
+        return CompactMarkovModel.from_windows(
+            [], np.zeros((0, model_order + 1), dtype=np.int32),
+            np.zeros(0, dtype=np.int64))
+
+    tokens, windows, counts, _, _ = partials[0]
+
+    return CompactMarkovModel.from_windows(tokens, windows, counts)
+
+
+def byte_ranges(file_path, chunk_size):
+    """Splits the file at file_path into (start, end) byte ranges of about
+    chunk_size bytes.  Every range ends just after a newline (or at the end
+    of the file), so no line is split between two ranges."""
+
+    ranges = []
+
+    with open(file_path, "rb") as infile:
+        infile.seek(0, os.SEEK_END)
+        size = infile.tell()
+
+        start = 0
+        while start < size:
+            # Jump ahead chunk_size bytes, then on to the end of that line
+            infile.seek(min(start + chunk_size, size))
+            infile.readline()
+            end = min(infile.tell(), size)
+            ranges.append((start, end))
+            start = end
+
+    return ranges
+
+
+def count_byte_range(task):
+    """Worker for parallel_markov_model.  Tokenizes one byte range of a
+    file, exactly as tokenize does, and counts its windows of
+    model_order + 1 tokens.
+
+       Arguments:
+            task:  tuple of (file_path, start, end, tokenizer, model_order)
+       returns:
+            partial:  tuple of
+                tokens:  list, the token for each id in this range
+                windows:  2D int32 array, the distinct windows of ids,
+                    sorted
+                counts:  int64 array, the frequency of each window
+                head:  int32 array, the ids of the first model_order
+                    tokens in the range
+                tail:  int32 array, the ids of the last model_order
+                    tokens
+
+    Windows that cross into the next range are counted by merge_partials,
+    from the tail of one range and the head of the next."""
+
+    file_path, start, end, tokenizer, model_order = task
+
+    with open(file_path, "rb") as infile:
+        infile.seek(start)
+        text = infile.read(end - start).decode("utf-8")
+
+    # splitlines breaks the text at the same line boundaries as reading
+    # the file with codecs.open
+    tokens, codes = intern_tokens(token
+                                  for line in text.splitlines()
+                                  for token in tokenizer(line.lower().strip()))
+
+    size = max(len(codes) - model_order, 0)
+    windows = np.column_stack([codes[col:col + size]
+                               for col in range(model_order + 1)])
+    windows, counts = count_windows(windows, None, len(tokens))
+
+    return (tokens, windows, counts, codes[:model_order],
+            codes[len(codes) - min(model_order, len(codes)):])
+
+
+def merge_partials(pair):
+    """Worker for parallel_markov_model.  Merges the counts of two
+    neighbouring byte ranges, first and second, into the counts of the
+    two ranges joined, as returned by count_byte_range."""
+
+    first, second = pair
+    tokens, windows, counts, head, tail = first
+    tokens2, windows2, counts2, head2, tail2 = second
+    model_order = windows.shape[1] - 1
+
+    # Give the second range's tokens the ids of the first, and new ids
+    # after those for tokens the first range did not have
+    tokens = list(tokens)
+    token_ids = dict((token, i) for i, token in enumerate(tokens))
+    mapping = np.empty(len(tokens2), dtype=np.int32)
+    for i, token in enumerate(tokens2):
+        if token not in token_ids:
+            token_ids[token] = len(tokens)
+            tokens.append(token)
+        mapping[i] = token_ids[token]
+
+    # The windows that start in the first range and end in the second lie
+    # in the first's tail followed by the second's head
+    joined = np.concatenate([tail, mapping[head2]])
+    size = max(len(joined) - model_order, 0)
+    crossing = np.column_stack([joined[col:col + size]
+                                for col in range(model_order + 1)])
+
+    windows, counts = count_windows(
+        np.vstack([windows, mapping[windows2], crossing]),
+        np.concatenate([counts, counts2, np.ones(size, dtype=np.int64)]),
+        len(tokens))
+
+    # A range shorter than model_order lends tokens to both ends
+    head = np.concatenate([head, mapping[head2]])[:model_order]
+    tail = np.concatenate([tail, mapping[tail2]])
+    tail = tail[len(tail) - min(model_order, len(tail)):]
+
+    return tokens, windows, counts, head, tail
+
+
+def count_windows(windows, counts, vocabulary_size):
+    """Adds up the counts of equal rows of windows.
+
+       Arguments:
+            windows:  2D int array, rows of token ids
+            counts:  int array, the count of each row, or None to count
+                each row once
+            vocabulary_size:  integer, one more than the largest id
+       returns:
+            windows:  2D int32 array, the distinct rows, sorted
+            counts:  int64 array, the total count of each"""
+
+    width = windows.shape[1]
+    base = max(vocabulary_size, 2)
+
+    if base ** width < 2 ** 62:
+        # Read each row as the digits of one integer in base
+        # vocabulary_size, and sort those, which is much faster than
+        # sorting rows
+        keys = np.zeros(len(windows), dtype=np.int64)
+        for col in range(width):
+            keys = keys * base + windows[:, col]
+        keys, inverse = np.unique(keys, return_inverse=True)
+
+        distinct = np.empty((len(keys), width), dtype=np.int32)
+        for col in range(width - 1, -1, -1):
+            distinct[:, col] = keys % base
+            keys //= base
+    else:
+        distinct, inverse = np.unique(windows, axis=0, return_inverse=True)
+        distinct = distinct.astype(np.int32)
+
+    totals = np.bincount(inverse.ravel(), weights=counts,
+                         minlength=len(distinct))
+
+    return distinct, np.rint(totals).astype(np.int64)
+
+
+def compact_markov_model(stream, model_order):
+    """Builds the same counts as markov_model, but stores them in a
+    CompactMarkovModel of integer arrays instead of tuple-keyed Counters.
+
+       Arguments:
+            stream:  iterable of tokens
+            model_order:  integer, the length of the prefixes
+       returns:
+            model:  CompactMarkovModel"""
+
+    # Give each distinct token an integer id, and store the stream as an
+    # array of ids.
+    tokens, codes = intern_tokens(stream)
+
+    # Each row of windows is a prefix of model_order ids followed by the
+    # id of the token that came after it.
+    size = max(len(codes) - model_order, 0)
+    windows = np.column_stack([codes[col:col + size]
+                               for col in range(model_order + 1)])
+
+    # Sorting the distinct windows groups them by prefix, and counts how
+    # often each one occurred.
+    windows, counts = count_windows(windows, None, len(tokens))
+
+    return CompactMarkovModel.from_windows(tokens, windows, counts)
+
+
+def intern_tokens(stream):
+    """Gives each distinct token an integer id, in the order first seen.
+
+       Arguments:
+            stream:  iterable of tokens, or a numpy array of them, such
+                as the one returned by char_array
+       returns:
+            tokens:  list, the token for each id
+            codes:  int32 array, the id of each token in the stream"""
+
+    if isinstance(stream, np.ndarray):
+        # Sort out the distinct tokens in bulk, then renumber them in the
+        # order each was first seen, to give the same ids as the loop
+        # below.
+        values, first, inverse = np.unique(stream, return_index=True,
+                                           return_inverse=True)
+        order = np.argsort(first)
+        ids = np.empty(len(order), dtype=np.int32)
+        ids[order] = np.arange(len(order), dtype=np.int32)
+
+        return values[order].tolist(), ids[inverse.ravel()]
+
+    token_ids = {}
+    codes = array.array('i')
+    for token in stream:
+        codes.append(token_ids.setdefault(token, len(token_ids)))
+    codes = np.array(codes, dtype=np.int32)
+
+    tokens = sorted(token_ids, key=token_ids.get)
+
+    return tokens, codes
+
+
+def entropy_rate_sweep(stream, max_order):
+    """Calculates the entropy of the stream under every model order from
+    0 to max_order in a single pass, instead of building a markov_model
+    for each order.
+
+    The stream is read once and every position is sorted by the
+    max_order + 1 tokens starting there (a suffix array cut off at that
+    depth).  Positions sharing their first n tokens are then neighbours,
+    so the n-gram counts of every order are runs in the same sorted array.
+    Each window is packed into one int64 key where the vocabulary allows,
+    as in count_windows, and the runs of each order are found from those
+    of the order before, so the sweep needs a few tens of bytes per token.
+
+       Arguments:
+            stream:  iterable of tokens, or a numpy array of them
+            max_order:  integer, the highest model order
+       returns:
+            rates:  array, rates[k] is the block entropy per token,
+                H(X_1,...,X_k+1) / (k + 1)
+            conditional:  array, conditional[k] is H(X_k+1 | X_1,...,X_k),
+                which equals entropy_rate(markov_model(stream, k))
+            contexts:  array, contexts[k] is the number of distinct
+                prefixes of length k, i.e. len(markov_model(stream, k))"""
+
+    tokens, codes = intern_tokens(stream)
+    size = len(codes)
+    depth = max_order + 1
+    base = len(tokens) + 1
+
+    # Shift the ids up by one and pad the end with 0, which is then not a
+    # token, so every position has a full window of depth digits.
+    padded = np.zeros(size + depth, dtype=np.int32)
+    padded[:size] = codes + 1
+
+    if base ** depth < 2 ** 62:
+        # Read each window as the digits of one integer in base, and sort
+        # those
+        keys = np.zeros(size, dtype=np.int64)
+        for col in range(depth):
+            keys *= base
+            keys += padded[col:col + size]
+        keys.sort()
+    else:
+        # Too many distinct tokens to pack the windows, so sort the
+        # positions by their windows (lexsort treats its last key as the
+        # primary one).  The slices of padded are views, not copies.
+        keys = None
+        positions = np.lexsort([padded[col:col + size]
+                                for col in range(depth - 1, -1, -1)])
+
+    # Orders too long for the stream are left as nan
+    rates = np.full(depth, np.nan)
+    conditional = np.full(depth, np.nan)
+    contexts = np.zeros(depth, dtype=np.int64)
+
+    # starts marks the sorted windows that begin a new n-gram, and valid
+    # the windows that stop before the padding.  For n = 0 all the
+    # windows form one n-gram.
+    starts = np.zeros(size, dtype=bool)
+    starts[:1] = True
+    valid = np.ones(size, dtype=bool)
+    prefix_firsts = np.zeros(1, dtype=np.int64)
+
+    for order in range(depth):
+        length = order + 1
+        if size < length:
+            break
+
+        # The digit of each sorted window at this order
+        if keys is not None:
+            digits = keys // base ** (depth - length) % base
+        else:
+            digits = padded[positions + order]
+
+        # Windows that began different (n - 1)-grams begin different
+        # n-grams, as do those whose next digits differ.  This is the
+        # longest common prefix of neighbours, built one digit at a time.
+        starts[1:] |= digits[1:] != digits[:-1]
+        valid &= digits != 0
+        del digits
+
+        firsts = np.flatnonzero(starts)
+        counts = np.add.reduceat(valid, firsts, dtype=np.int64)
+
+        # Each n-gram's prefix is the (n - 1)-gram its first window falls
+        # in.  The n-grams are sorted by prefix, so they form one ragged
+        # array of next-token counts per prefix.
+        present = counts > 0
+        parents = np.searchsorted(prefix_firsts, firsts[present],
+                                  side="right") - 1
+        offsets = np.searchsorted(parents, np.arange(parents[-1] + 2))
+        prefix_firsts = firsts
+
+        entropies, prefix_freqs = it.entropies_from_frequencies(
+            counts[present], offsets)
+
+        rates[order] = it.entropy_from_frequencies(counts[present]) / length
+        conditional[order] = (np.dot(prefix_freqs, entropies) /
+                              prefix_freqs.sum())
+        contexts[order] = np.count_nonzero(prefix_freqs)
+
+    return rates, conditional, contexts
+
+
+class CompactMarkovModel(object):
+    """A Markov model held in sorted integer arrays.
+
+    Tokens are interned as integer ids (tokens[id] gives the token back).
+    The distinct prefixes are the rows of prefixes, sorted.  The tokens
+    that followed prefix row i, and their counts, are
+
+        suffixes[offsets[i]:offsets[i + 1]]
+        counts[offsets[i]:offsets[i + 1]]
+
+    This takes a few bytes per entry, where markov_model takes hundreds
+    for each tuple key and Counter.  The model also behaves like the dict
+    returned by markov_model (model[prefix] gives a Counter), so
+    entropy_rate, generate, pick and seed all accept it."""
+
+    # The arrays written by save and read by load, in __init__ order
+    ARRAYS = ("prefixes", "offsets", "suffixes", "counts")
+
+    def __init__(self, tokens, prefixes, offsets, suffixes, counts):
+        """Arguments:
+                tokens:  list, the token for each id
+                prefixes:  2D int array, one sorted row of ids per prefix
+                offsets:  int array, len(prefixes) + 1 positions into
+                    suffixes and counts
+                suffixes:  int array, the ids of the following tokens
+                counts:  int array, the frequency of each suffix"""
+
+        self.tokens = tokens
+        self.token_ids = dict((token, i) for i, token in enumerate(tokens))
+        self.prefixes = prefixes
+        self.offsets = offsets
+        self.suffixes = suffixes
+        self.counts = counts
+        self.model_order = prefixes.shape[1]
+
+    @classmethod
+    def from_windows(cls, tokens, windows, counts):
+        """Arguments:
+                tokens:  list, the token for each id
+                windows:  2D int array, distinct rows of prefix ids
+                    followed by a suffix id, sorted
+                counts:  int array, the frequency of each window
+           returns:
+                model:  CompactMarkovModel"""
+
+        model_order = windows.shape[1] - 1
+
+        # A new prefix starts wherever a row's prefix differs from the row
+        # before it.
+        changes = np.any(windows[1:, :model_order] !=
+                         windows[:-1, :model_order], axis=1)
+        starts = np.flatnonzero(np.concatenate([[len(windows) > 0],
+                                                changes]))
+
+        return cls(tokens,
+                   np.ascontiguousarray(windows[starts, :model_order],
+                                        dtype=np.int32),
+                   np.append(starts, len(windows)).astype(np.int64),
+                   np.ascontiguousarray(windows[:, model_order],
+                                        dtype=np.int32),
+                   np.asarray(counts, dtype=np.int64))
+
+    @classmethod
+    def from_model(cls, model, model_order):
+        """Arguments:
+                model:  a dict of prefix Counters, as built by markov_model
+                model_order:  integer, the length of the prefixes
+           returns:
+                model:  CompactMarkovModel holding the same counts"""
+
+        token_ids = {}
+        windows = []
+        counts = []
+        for prefix, counter in model.items():
+            for suffix, count in counter.items():
+                windows.append([token_ids.setdefault(token, len(token_ids))
+                                for token in prefix + (suffix, )])
+                counts.append(count)
+
+        tokens = sorted(token_ids, key=token_ids.get)
+        windows = np.array(windows, dtype=np.int32).reshape(
+            len(counts), model_order + 1)
+        counts = np.array(counts, dtype=np.int64)
+
+        # Sort the windows row by row (lexsort treats its last key as the
+        # primary one)
+        order = np.lexsort(windows.T[::-1])
+
+        return cls.from_windows(tokens, windows[order], counts[order])
+
+    def save(self, directory):
+        """Writes the model to directory as plain .npy arrays, plus the
+        tokens as JSON, so it can be memory-mapped back by load.
+
+           Arguments:
+                directory:  string, an existing directory"""
+
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, name + ".npy"),
+                    getattr(self, name))
+
+        with open(os.path.join(directory, "tokens.json"), "w") as outfile:
+            json.dump(self.tokens, outfile)
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        """Arguments:
+                directory:  string, a directory written by save
+                mmap_mode:  as for np.load.  By default the arrays are
+                    memory-mapped read only rather than read into memory.
+           returns:
+                model:  CompactMarkovModel"""
+
+        with open(os.path.join(directory, "tokens.json")) as infile:
+            tokens = json.load(infile)
+
+        arrays = [np.load(os.path.join(directory, name + ".npy"),
+                          mmap_mode=mmap_mode)
+                  for name in cls.ARRAYS]
+
+        return cls(tokens, *arrays)
+
+    def nbytes(self):
+        """returns:
+                integer, the bytes used by the model's arrays"""
+
+        return (self.prefixes.nbytes + self.offsets.nbytes +
+                self.suffixes.nbytes + self.counts.nbytes)
+
+    def find(self, prefix):
+        """Arguments:
+                prefix:  tuple of model_order tokens
+           returns:
+                index:  integer, the row of prefix in prefixes, or None if
+                    the model does not contain it"""
+
+        if len(prefix) != self.model_order:
+            return None
+
+        # Narrow the range of matching rows one column at a time.  The
+        # rows are sorted, so each column is sorted within the range left.
+        low, high = 0, len(self.prefixes)
+        for col, token in enumerate(prefix):
+            if token not in self.token_ids:
+                return None
+            token_id = self.token_ids[token]
+            column = self.prefixes[low:high, col]
+            low, high = (low + np.searchsorted(column, token_id, 'left'),
+                         low + np.searchsorted(column, token_id, 'right'))
+            if low == high:
+                return None
+
+        return low
+
+    def successors(self, index):
+        """Arguments:
+                index:  integer, a row of prefixes
+           returns:
+                counter:  Counter, the frequency of each following token"""
+
+        start, end = self.offsets[index], self.offsets[index + 1]
+        suffixes = [self.tokens[i] for i in self.suffixes[start:end]]
+
+        return Counter(dict(zip(suffixes, self.counts[start:end].tolist())))
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    def __contains__(self, prefix):
+        return self.find(prefix) is not None
+
+    def __iter__(self):
+        for row in self.prefixes:
+            yield tuple(self.tokens[i] for i in row)
+
+    def __getitem__(self, prefix):
+        # Like the defaultdict from markov_model, an unknown prefix gives
+        # an empty Counter
+        index = self.find(prefix)
+        if index is None:
+            return Counter()
+
+        return self.successors(index)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self.successors(index) for index in range(len(self))]
+
+    def items(self):
+        return list(zip(self, self.values()))
+
+
+def cached_markov_model(file_path, reader, model_order,
+                        cache_dir=".markov_cache",
+                        max_bytes=1024 * 1024 * 1024):
+    """Returns compact_markov_model(reader(file_path), model_order), from an
+    on-disk cache when the same file has been modelled before.
+
+    Entries are keyed by a hash of the file's contents, the reader and the
+    model order, so editing the file or changing the order builds a new
+    model.  Each entry is a directory written by CompactMarkovModel.save,
+    and is memory-mapped back, so a cached model opens almost instantly.
+    When the cache grows past max_bytes, the least recently used entries
+    are deleted.
+
+       Arguments:
+            file_path:  string.  The path to the file to read in.
+            reader:  function, chars or words
+            model_order:  integer, the length of the prefixes
+            cache_dir:  string, the directory holding the cache
+            max_bytes:  integer, the size cap of the cache
+       returns:
+            model:  CompactMarkovModel"""
+
+    key = "%s-%s-%d" % (file_hash(file_path), reader.__name__, model_order)
+    entry = os.path.join(cache_dir, key)
+
+    if not os.path.isdir(entry):
+        # The bulk readers give the same tokens as chars and words, but
+        # read the file a block at a time instead of a line at a time.
+        if reader is chars:
+            stream = char_array(file_path)
+        elif reader is words:
+            stream = itertools.chain.from_iterable(word_batches(file_path))
+        else:
+            stream = reader(file_path)
+        model = compact_markov_model(stream, model_order)
+
+        # Write to a temporary directory and rename it into place, so
+        # another process never sees a half-written entry.
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        partial = tempfile.mkdtemp(dir=cache_dir, prefix=".partial-")
+        model.save(partial)
+        try:
+            os.rename(partial, entry)
+        except OSError:
+            # Another process has just cached the same model
+            shutil.rmtree(partial)
+
+    # Mark the entry as the most recently used
+    os.utime(entry, None)
+    evict_cache_entries(cache_dir, max_bytes, keep=key)
+
+    return CompactMarkovModel.load(entry)
+
+
+def file_hash(file_path, block_size=1024 * 1024):
+    """Returns the SHA-1 hex digest of the contents of the file at
+    file_path."""
+
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as infile:
+        for block in iter(lambda: infile.read(block_size), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def evict_cache_entries(cache_dir, max_bytes, keep=None):
+    """Deletes the least recently used entries of the model cache in
+    cache_dir until it holds no more than max_bytes.  The entry named
+    keep is never deleted."""
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        if name.startswith(".") or not os.path.isdir(entry):
+            continue
+        size = sum(os.path.getsize(os.path.join(entry, filename))
+                   for filename in os.listdir(entry))
+        entries.append((os.path.getmtime(entry), size, name))
+
+    total = sum(size for _, size, _ in entries)
+
+    # Oldest first
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        if name == keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+        total -= size
+
+
 def tokenize(file_path, tokenizer):
     """A generator function reads in the file at file_path and uses the passed
     tokenizer function to yield tokens.  Generator functions are 'lazy'.  They
@@ -198,67 +860,216 @@ def words(file_path):
     return tokenize(file_path, break_into_words)
 
 
-def entropy_rate(model):
-    """Calculates the average entropy of the model data.  Does this by
-    calculating the entropy for each prefix and weighting it by the
-    frequency with which the prefix appears."""
+def mapped_blocks(file_path, block_size=16 * 1024 * 1024):
+    """A generator function that memory-maps the file at file_path and
+    yields its text in decoded blocks of about block_size bytes.  Every
+    block ends at the end of a line, so no line (or UTF-8 character) is
+    split between blocks.
 
-    # Initialise counts
-    total_freq = 0
-    weighted_entropy = 0
+       Arguments:
+            file_path:  string.  The path to the file to read in.
+            block_size:  integer, the approximate number of bytes per block
+       returns:
+            text:  the next block of the file"""
+
+    with open(file_path, "rb") as infile:
+        # An empty file cannot be mapped
+        if not os.fstat(infile.fileno()).st_size:
+            return
+
+        mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = 0
+            while start < len(mapped):
+                # Jump ahead block_size bytes, then on to the end of that
+                # line
+                end = mapped.find(b"\n", start + block_size) + 1
+                if end == 0:
+                    end = len(mapped)
+                yield mapped[start:end].decode("utf-8")
+                start = end
+        finally:
+            mapped.close()
+
+
+def char_codes(file_path, block_size=16 * 1024 * 1024):
+    """A bulk version of chars.  It yields the same characters, but as
+    arrays of unicode code points, one array per block of the file.
 
-    # Loop for all prefixes
-    for prefix in model:
-        # The square brackets denote a list comprehension, which is read from
-        # left to right.
-        # In words : "Make a list of the frequencies for
-        # each item beginning with prefix.
-        freqs = [freq for freq in model[prefix].values()]
+       Arguments:
+            file_path:  string.  The path to the file to read in.
+            block_size:  integer, the approximate number of bytes per block
+       returns:
+            codes:  uint32 array, the code points of the next block"""
 
-        # Calculate the total frequency of all tokens beginning with
-        # this prefix
-        prefix_freq = sum(freqs)
+    for block in mapped_blocks(file_path, block_size):
+        # As in chars, each line is lowercased and stripped, and has a
+        # space appended.  splitlines breaks the block at the same line
+        # boundaries as reading the file with codecs.open.
+        text = "".join([line.strip() + " "
+                        for line in block.lower().splitlines()])
 
-        # Increment the total frequency for the whole model
-        total_freq += prefix_freq
+        yield np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
 
-        # Calculate the weighted entropy from this prefix.
-        weighted_entropy += prefix_freq * it.entropy_from_frequencies(freqs)
 
-    # Calculate the average entropy across all the prefix distributions
-    return weighted_entropy / total_freq
+def char_array(file_path, block_size=16 * 1024 * 1024):
+    """Reads the whole of the file at file_path into one array of the
+    characters chars would yield, ready for intern_tokens.
 
+       Arguments:
+            file_path:  string.  The path to the file to read in.
+            block_size:  integer, the approximate number of bytes per block
+       returns:
+            characters:  numpy array of single unicode characters"""
 
-def generate(model, length):
-    """A function to create a random sample of length tokens (a token could be
-    a word or character).
-    After each iteration we modify the seed/state
-    by removing the first element of the token and appending a random prefix
-    from our model based on the new value of state."""
+    blocks = list(char_codes(file_path, block_size))
+    if not blocks:
+        return np.zeros(0, dtype="<U1")
+
+    # Each code point is stored in 4 bytes, the same layout numpy uses for
+    # a one character unicode string, so the codes can be viewed as
+    # characters without copying them.
+    return np.concatenate(blocks).view("<U1")
+
+
+def word_batches(file_path, block_size=16 * 1024 * 1024):
+    """A bulk version of words.  It yields the same words, but as one list
+    per block of the file.
+
+       Arguments:
+            file_path:  string.  The path to the file to read in.
+            block_size:  integer, the approximate number of bytes per block
+       returns:
+            words:  list, the words in the next block"""
 
-    text = []
+    for block in mapped_blocks(file_path, block_size):
+        # Words never span a line break, so the whole block can be broken
+        # into words at once.
+        yield break_into_words(block.lower())
 
-    # Pick a random seed as a start point
-    # e.g. For words with a prefix length of 3, this could be
-    # "of each organic"
-    prefix = seed(model)
 
-    # Loop building up text
-    for _ in range(length):
+def entropy_rate(model):
+    """Calculates the average entropy of the model data.  Does this by
+    calculating the entropy for each prefix and weighting it by the
+    frequency with which the prefix appears."""
+
+    # Calculate the entropy of the distribution following every prefix,
+    # and the total frequency of each prefix, in one batch.
+    if isinstance(model, CompactMarkovModel):
+        # The counts are already laid out prefix by prefix
+        entropies, prefix_freqs = it.entropies_from_frequencies(
+            model.counts, model.offsets)
+    else:
+        entropies, prefix_freqs = it.entropies_from_frequencies(
+            counter.values() for counter in model.values())
 
-        # Store the first word/char of the current state
-        # In our example, would be 'of' for first pass in our example
-        text.append(prefix[0])
+    # Calculate the weighted entropy from each prefix, then the average
+    # entropy across all the prefix distributions
+    return float(np.dot(prefix_freqs, entropies) / prefix_freqs.sum())
 
-        # Pick a new word to append to the current prefix.  The pick function
-        # looks at the distribution of words/chars starting with prefix
-        # and picks one at random from the distribution
-        # For example, or new prefix now drops the 'of' and may become
-        # "each organic compound".
-        # Then loop with this new prefix.
-        prefix = prefix[1:] + (pick(model[prefix]), )
 
-    return text
+def generate(model, length, random_seed=None):
+    """A function to create a random sample of length tokens (a token could be
+    a word or character).
+    After each iteration we modify the seed/state
+    by removing the first element of the token and appending a random prefix
+    from our model based on the new value of state.
+
+    model can be a dict from markov_model, a CompactMarkovModel or a
+    MarkovSampler.  Passing a MarkovSampler avoids compiling the model again
+    on every call.  Each token then costs O(log k) for k possible next
+    tokens.  The same random_seed always gives the same text."""
+
+    if not isinstance(model, MarkovSampler):
+        model = MarkovSampler(model)
+
+    return model.generate(length, random_seed)
+
+
+class MarkovSampler(object):
+    """A model compiled for fast random sampling by generate.
+
+    Every entry of the model (a prefix followed by one possible next token)
+    is given
+        cumulative[j]:  the running total of the counts up to entry j, so a
+            next token can be picked by binary search, as pick does by
+            stepping through the counter
+        next_rows[j]:  the prefix row reached by dropping the first token
+            of the prefix and appending the next token, or -1 if that
+            prefix never occurs
+    and prefix_cumulative holds the running total over the prefixes, for
+    picking a seed as seed does."""
+
+    def __init__(self, model):
+        """Arguments:
+                model:  a dict from markov_model or a CompactMarkovModel"""
+
+        if not isinstance(model, CompactMarkovModel):
+            model_order = len(next(iter(model))) if model else 0
+            model = CompactMarkovModel.from_model(model, model_order)
+
+        if not len(model):
+            raise ValueError("No frequency values in passed model")
+
+        self.model = model
+        offsets = model.offsets
+
+        self.cumulative = np.cumsum(model.counts)
+        self.prefix_cumulative = self.cumulative[offsets[1:] - 1]
+
+        # The prefix row of every entry, and the prefix it leads to
+        rows = np.repeat(np.arange(len(model)), np.diff(offsets))
+        next_prefixes = np.column_stack(
+            [model.prefixes[rows], model.suffixes])[:, 1:]
+
+        if model.model_order == 0:
+            # Every next token leads back to the empty prefix
+            self.next_rows = np.zeros(len(rows), dtype=np.int64)
+        else:
+            # Find each next prefix among the prefixes by sorting them
+            # together; equal rows share a group number.
+            _, groups = np.unique(
+                np.concatenate([model.prefixes, next_prefixes]),
+                axis=0, return_inverse=True)
+            groups = groups.ravel()
+            group_rows = np.full(groups.max() + 1, -1, dtype=np.int64)
+            group_rows[groups[:len(model)]] = np.arange(len(model))
+            self.next_rows = group_rows[groups[len(model):]]
+
+    def generate(self, length, random_seed=None):
+        """Arguments:
+                length:  integer, the number of tokens to generate
+                random_seed:  optional integer, seeds the random numbers
+           returns:
+                text:  list of length tokens"""
+
+        rng = np.random.RandomState(random_seed)
+        model = self.model
+        offsets = model.offsets
+        cumulative = self.cumulative
+
+        # Pick a random seed prefix as a start point, weighted by frequency
+        target = rng.randint(self.prefix_cumulative[-1])
+        row = int(np.searchsorted(self.prefix_cumulative, target, 'right'))
+        codes = list(model.prefixes[row])
+
+        while len(codes) < length:
+            if row < 0:
+                raise ValueError("No frequency values in passed counter")
+
+            # Pick a random entry for this prefix, weighted by frequency.
+            # The counts of the prefix's entries run from low to high in
+            # cumulative.
+            start, end = offsets[row], offsets[row + 1]
+            low = cumulative[start - 1] if start else 0
+            target = low + rng.randint(cumulative[end - 1] - low)
+            entry = start + int(np.searchsorted(cumulative[start:end],
+                                                target, 'right'))
+
+            codes.append(model.suffixes[entry])
+            row = self.next_rows[entry]
+
+        return [model.tokens[code] for code in codes[:length]]
 
 
 def pick(counter):
@@ -41,22 +41,25 @@ def main():
                     [0, 10, 21, 4],
                     [0, 2, 15, 12]]
 
-    col_total_frequencies = it.col_totals(distribution)  # Get col total freqs
-    row_total_frequencies = it.row_totals(distribution)  # Get row total freqs
+    # The rows of the table are the outputs Y (axis 0) and the columns
+    # are the inputs X (axis 1)
+    joint = it.JointDistribution(distribution)
 
-    allfrequencies = it.flatten(distribution)   # Make flat list of all freqs
+    # Get the col & row total freqs
+    col_total_frequencies = [int(f) for f in joint.marginal(1)]
+    row_total_frequencies = [int(f) for f in joint.marginal(0)]
 
     # HX is the entropy of the input values (col totals)
-    HX = it.entropy_from_frequencies(col_total_frequencies)
+    HX = joint.entropy(1)
 
     # HY is the entropy of the output values (row totals)
-    HY = it.entropy_from_frequencies(row_total_frequencies)
+    HY = joint.entropy(0)
 
     # HXY is the entropy of the whole distribution
-    HXY = it.entropy_from_frequencies(allfrequencies)
+    HXY = joint.entropy()
 
     # IXY Mutual information
-    IXY = HX + HY - HXY
+    IXY = joint.mutual_information(1, 0)
 
     # Prepare the graphic
     pyplot.figure("Example 4.1", figsize=(10, 4))
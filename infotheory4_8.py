@@ -22,7 +22,8 @@ Eq. 4.84	H(Y|X) = 0.470 bits
 Eq. 4.88	H(noise) = 0.469 bits
 """
 
-import random
+import multiprocessing
+import numpy as np
 from matplotlib import pyplot
 from PIL import Image
 import information_theory as it
@@ -36,73 +37,28 @@ def main():
     # Open the image
     image = Image.open("image1_6.jpg")
 
-    # Get image size
-    xsize, ysize = image.size
-
-    # Load pixels
-    pixels = image.load()
-
-    # Make a black and white image from the original
-    # Loop over all pixels if greyscale value > 150 make black, else white
-    for row in range(ysize):
-        for col in range(xsize):
-            if pixels[col, row] > 150:
-                pixels[col, row] = 255
-            else:
-                pixels[col, row] = 0
+    # Make a black and white image from the original, and pass it through
+    # a channel which flips each pixel with probability PNOISE
+    inputs, outputs, joint_counts = simulate_binary_channel(image, PNOISE)
 
     pyplot.figure("Example 4.8", figsize=(10, 8))
 
     # Show the black and white image
     pyplot.subplot(2, 2, 1)
     pyplot.title("Original (input, X)")
-    pyplot.imshow(image, cmap='gray')
+    pyplot.imshow(inputs, cmap='gray')
     pyplot.axis('off')
 
-    # Initialise the joint probability of input-->output (ref Table 4.3 P99)
-    jointprob = [[0.0, 0.0], [0.0, 0.0]]
-
-    # each occurrence of a particular outcome is equivalent to a small
-    # probability increment.
-    probability_increment = 1.0 / (xsize * ysize)
-
-    # Loop over all pixels and changes its state with probability PNOISE
-    for row in range(0, ysize):
-        for col in range(0, xsize):
-            if random.random() >= (1.0 - PNOISE):
-                if pixels[col, row]:
-                    pixels[col, row] = 0
-                    jointprob[1][0] += probability_increment
-                else:
-                    pixels[col, row] = 255
-                    jointprob[0][1] += probability_increment
-            elif pixels[col, row]:
-                jointprob[1][1] += probability_increment
-            else:
-                jointprob[0][0] += probability_increment
+    # The joint probability of input-->output (ref Table 4.3 P99)
+    jointprob = (joint_counts / float(joint_counts.sum())).tolist()
 
     # Show the noisy black and white image
     pyplot.subplot(2, 2, 2)
     pyplot.title("Noisy (output, Y)")
-    pyplot.imshow(image, cmap='gray')
+    pyplot.imshow(outputs, cmap='gray')
     pyplot.axis('off')
 
-    col_total_probabilities = it.col_totals(jointprob)
-    row_total_probabilities = it.row_totals(jointprob)
-
-    allprobabilities = it.flatten(jointprob)
-
-    # HX is the entropy of the input (original binary image)
-    HX = it.entropy_from_probabilities(row_total_probabilities)
-
-    # HY is the entropy of the output (noisy binary image)
-    HY = it.entropy_from_probabilities(col_total_probabilities)
-
-    # HXY is the entropy of the joint distribution
-    HXY = it.entropy_from_probabilities(allprobabilities)
-    
-    # IXY = mutual information between input and output
-    IXY = HX + HY - HXY    # Eq 4.76
+    HX, HY, HXY, IXY, HX_given_Y, HY_given_X = channel_entropies(joint_counts)
 
     # Analytic value for noise Eq. 4.88
     noise = sum([p * it.log2(1.0 / p) for p in [PNOISE, 1.0 - PNOISE]])
@@ -134,8 +90,8 @@ def main():
             ["H(Y)", it.strrounddp(HY, SIGFIGS), "Eq. 4.71"],
             ["H(X,Y)", it.strrounddp(HXY, SIGFIGS), "Eq. 4.75"],
             ["I(X,Y)", it.strrounddp(IXY, SIGFIGS), "Eq. 4.78"],
-            ["H(X|Y)", it.strrounddp(HX - IXY, SIGFIGS), "Eq. 4.81"],
-            ["H(Y|X)", it.strrounddp(HY - IXY, SIGFIGS), "Eq. 4.84"],
+            ["H(X|Y)", it.strrounddp(HX_given_Y, SIGFIGS), "Eq. 4.81"],
+            ["H(Y|X)", it.strrounddp(HY_given_X, SIGFIGS), "Eq. 4.84"],
             ["H(noise)", it.strrounddp(noise, SIGFIGS), "Eq. 4.88"]]
 
     pyplot.subplot(2, 2, 4)
@@ -148,5 +104,154 @@ def main():
 
     pyplot.show()
 
+
+def simulate_binary_channel(image, pnoise, threshold=150, random_seed=None,
+                            chunk_size=1024 * 1024):
+    """Makes a black and white image and passes it through a binary
+    symmetric channel, using array operations rather than a loop over the
+    pixels.
+
+       Arguments:
+            image:  a single channel PIL image or 2D numpy array
+            pnoise:  float, the probability that the channel flips a pixel
+            threshold:  pixels brighter than threshold are white (1), the
+                rest black (0)
+            random_seed:  optional integer, seeds the random numbers so
+                the same seed always gives the same noise
+            chunk_size:  integer, the number of pixels given noise at a
+                time, which bounds the memory used for random numbers
+       returns:
+            inputs:  bool array, the black and white image, X
+            outputs:  bool array, the noisy image, Y
+            joint_counts:  2x2 int array.  joint_counts[x][y] is the number
+                of pixels with input x and output y."""
+
+    rng = np.random.RandomState(random_seed)
+
+    inputs = np.asarray(image) > threshold
+
+    # Flip each pixel with probability pnoise, a chunk at a time
+    flat_inputs = inputs.ravel()
+    outputs = np.empty_like(flat_inputs)
+    for start in range(0, len(flat_inputs), chunk_size):
+        end = start + chunk_size
+        flips = rng.random_sample(len(flat_inputs[start:end])) < pnoise
+        outputs[start:end] = flat_inputs[start:end] ^ flips
+    outputs = outputs.reshape(inputs.shape)
+
+    # Count each (input, output) pair as the integer 2 * x + y.  Counting
+    # integers, rather than adding up small probabilities, is exact.
+    pairs = 2 * inputs.ravel().astype(np.intp) + outputs.ravel()
+    joint_counts = np.bincount(pairs, minlength=4).reshape(2, 2)
+
+    return inputs, outputs, joint_counts
+
+
+def channel_entropies(joint_counts):
+    """Arguments:
+            joint_counts:  2D array of counts (or probabilities),
+                joint_counts[x][y] for input x and output y
+       returns:
+            HX:  float, the entropy of the input (Eq. 4.68)
+            HY:  float, the entropy of the output (Eq. 4.71)
+            HXY:  float, the entropy of the joint distribution (Eq. 4.75)
+            IXY:  float, the mutual information (Eq. 4.76)
+            HX_given_Y:  float, H(X|Y) (Eq. 4.81)
+            HY_given_X:  float, H(Y|X) (Eq. 4.84)"""
+
+    # The input X is axis 0 and the output Y axis 1
+    joint = it.JointDistribution(joint_counts)
+
+    IXY = joint.mutual_information(0, 1)    # Eq 4.76
+
+    return (joint.entropy(0), joint.entropy(1), joint.entropy(), IXY,
+            joint.conditional_entropy(0, 1), joint.conditional_entropy(1, 0))
+
+
+def noise_sweep(image, noise_levels, repetitions=10, processes=None,
+                random_seed=0, threshold=150):
+    """Runs simulate_binary_channel for every noise level in noise_levels,
+    repetitions times each, in a pool of worker processes, and measures
+    the mutual information I(X;Y) of each run.
+
+    Every run has its own random number stream, seeded by (random_seed,
+    noise level index, repetition), so the runs are independent and the
+    whole sweep can be reproduced exactly.
+
+       Arguments:
+            image:  a single channel PIL image or 2D numpy array
+            noise_levels:  list of floats, the values of PNOISE to try
+            repetitions:  integer, the number of runs at each noise level
+            processes:  integer, the number of worker processes.  Defaults
+                to the number of cores.
+            random_seed:  integer, seeds the whole sweep
+            threshold:  as for simulate_binary_channel
+       returns:
+            IXY:  array (noise levels x repetitions), I(X;Y) of each run
+            mean:  array, the mean I(X;Y) at each noise level
+            low, high:  arrays, the 95% confidence interval of each mean,
+                mean -/+ 1.96 standard errors
+            capacity:  array, the analytic value 1 - H(PNOISE), which is
+                the capacity of the channel.  It is reached only when
+                black and white inputs are equally likely; for other
+                inputs I(X;Y) is H(Y) - H(PNOISE).  (Eq. 4.88)"""
+
+    pixels = np.asarray(image)
+    noise_levels = list(noise_levels)
+
+    tasks = [(pnoise, (random_seed, level, repetition), threshold)
+             for level, pnoise in enumerate(noise_levels)
+             for repetition in range(repetitions)]
+
+    # Each worker is given the image once, rather than with every task
+    pool = multiprocessing.Pool(processes, initializer=set_sweep_image,
+                                initargs=(pixels, ))
+    try:
+        results = pool.map(sweep_task, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    IXY = np.array(results).reshape(len(noise_levels), repetitions)
+
+    mean = IXY.mean(axis=1)
+    if repetitions > 1:
+        error = 1.96 * IXY.std(axis=1, ddof=1) / np.sqrt(repetitions)
+    else:
+        error = np.full(len(noise_levels), np.nan)
+
+    capacity = np.array([1.0 - it.entropy_from_probabilities([p, 1.0 - p])
+                         for p in noise_levels])
+
+    return IXY, mean, mean - error, mean + error, capacity
+
+
+# The image used by sweep_task in each worker process
+SWEEP_IMAGE = None
+
+
+def set_sweep_image(pixels):
+    """Worker initializer for noise_sweep.  Stores the image to sweep."""
+
+    global SWEEP_IMAGE
+    SWEEP_IMAGE = pixels
+
+
+def sweep_task(task):
+    """Worker for noise_sweep.  Runs one noisy channel simulation.
+
+       Arguments:
+            task:  tuple of (pnoise, random_seed, threshold)
+       returns:
+            IXY:  float, the mutual information of the run"""
+
+    pnoise, random_seed, threshold = task
+
+    _, _, joint_counts = simulate_binary_channel(
+        SWEEP_IMAGE, pnoise, threshold, random_seed)
+
+    return channel_entropies(joint_counts)[3]
+
+
 if __name__ == "__main__":
     main()
@@ -44,24 +44,25 @@ def main():
 
     xvals = np.random.normal(mean, sd, size)
 
+    # The bin width and number of bins for each histogram, followed by the
+    # subplot and the number of bins displayed
+    histograms = [(1.0, 11, 1, 7), (0.5, 23, 2, 15), (0.1, 111, 3, 71)]
+
+    # Calculate the entropies for all bin widths from one sorted copy of
+    # the data.  Values more than binwidth * numbins / 2 standard
+    # deviations out are ignored.
+    all_HX, all_HXdiff = it.diff_entropies_from_sample(
+        xvals, [(binwidth, numbins) for binwidth, numbins, _, _ in histograms])
+
     # Loop for each histogram for which we set a bin size and the number
     # of bins
-    for bins in [(1.0, 11, 1, 7), (0.5, 23, 2, 15), (0.1, 111, 3, 71)]:
+    for index, bins in enumerate(histograms):
         binwidth, numbins, figure, bins_display = bins
-        # Set the +/ standard deviation range
-        sdrange = binwidth * numbins / 2.0
-        # Ignore any values more than sdrange standard deviations out
-        xtrunc = [x for x in xvals if abs(x) < sdrange]
-        # Set the bin edges
-        binedges = [x * binwidth - sdrange for x in range(numbins + 1)]
-        # bin the data
-        xhist, _ = np.histogram(xtrunc, binedges)
+
         # Eq. 5.18 P 116
-        HX = it.entropy_from_frequencies(xhist)
-        HX = it.strrounddp(HX, SIGFIGS)
-        # Find differential entropy 
-        HXdiff = it.entropy_from_frequencies(xhist) - it.log2(1.0 / binwidth)
-        HXdiff = it.strrounddp(HXdiff, SIGFIGS)
+        HX = it.strrounddp(all_HX[index], SIGFIGS)
+        # Find differential entropy
+        HXdiff = it.strrounddp(all_HXdiff[index], SIGFIGS)
 
         # Create the histogram graphic
 
@@ -71,7 +72,7 @@ def main():
         # Set the +/ standard deviation range
         # Ignore any values more than sdrange standard deviations out
         sdrange = binwidth * bins_display / 2.0
-        xtrunc = [x for x in xtrunc if abs(x) < sdrange]
+        xtrunc = xvals[np.abs(xvals) < sdrange]
 
         # Set the bin edges
         binedges = [x * binwidth - sdrange for x in range(bins_display + 1)]
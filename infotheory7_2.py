@@ -10,7 +10,7 @@ You are free to share and adapt for non-commercial purposes only.
 Summary: The code recreates the Figure 7.2 P160, using Eq. 7.40,
 which shows the probability of error as a function of message length.
 """
-import math
+import numpy as np
 from matplotlib import pyplot
 import information_theory as it
 
@@ -19,26 +19,14 @@ POINTS_TO_PLOT = 100 + 1
 def main():
     """Main function for Figure 7.1 example"""
 
-    # Initialise our x & y result lists
-    xvals = [0] * POINTS_TO_PLOT
-    yvals = [0] * POINTS_TO_PLOT
-
-    # Work out the step size along the x axis
+    # Work out the step size along the x axis, and the message length at
+    # each point
     xstep = 4000.0 / float(POINTS_TO_PLOT)
+    xvals = np.arange(POINTS_TO_PLOT) * xstep
 
-    # Calculate the error using Eq. 7.40 P159
-    # Uses P = 10, N = 1, R = 0.99, C = 1.0
-    # The terms involving just P, N, R & C are static, so calculate
-    # them out of the loop
-    #  math.sqrt((2 * P * (P + N)) / (N * (P + 2 * N))) * (R - C)
-    static = math.sqrt(220.0 / 12.0) * -0.01
-
-    # Loop to work out the list of x & y values
-    for cnt in range(POINTS_TO_PLOT):
-        message_length = cnt * xstep
-
-        xvals[cnt] = message_length
-        yvals[cnt] = it.cumulative_gaussian(math.sqrt(message_length) * static)
+    # Calculate the error using Eq. 7.40 P159 for every message length
+    # at once.  Uses P = 10, N = 1, R = 0.99, C = 1.0
+    yvals = it.error_probability(xvals, P=10.0, N=1.0, R=0.99, C=1.0)
 
     # Plot the curve, set title & label the axes
     pyplot.figure("Example 7.2")